@@ -1,11 +1,13 @@
-from flask import Flask, jsonify
+from flask import Flask
 from flask_cors import CORS
+from werkzeug.exceptions import HTTPException
+import atexit
 import logging
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
-from .core.config import Config
-from .core.db import init_db
-from .core.utils import error_response
+from .core.config import Config, SETTINGS
+from .core.db import init_db, close_conn
+from .core.utils import error_response, OrjsonProvider
 from .services.agent_service import agent_service
 
 from .api.auth import auth_bp
@@ -16,9 +18,11 @@ from .api.memories import memories_bp
 def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
+    app.json = OrjsonProvider(app)
     
     # Init Config (logging)
     config_class.init_app(app)
+    SETTINGS.load(app.config)
     
     # CORS
     CORS(app, origins=app.config['CORS_ORIGINS'], supports_credentials=True)
@@ -36,7 +40,15 @@ def create_app(config_class=Config):
     with app.app_context():
         init_db(app)
 
-    # Global Error Handlers
+    # 请求级数据库连接在应用上下文结束时关闭
+    app.teardown_appcontext(close_conn)
+
+    # 后台线程池：预热、记忆清理等不阻塞 HTTP 响应
+    executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='bg')
+    app.extensions['background_executor'] = executor
+    atexit.register(executor.shutdown, wait=False)
+
+    # Global Error Handlers：统一经 error_response 返回，所有错误体形状一致（含 timestamp）
     @app.errorhandler(404)
     def not_found(error):
         return error_response('资源不存在', 'NOT_FOUND', 404)
@@ -46,29 +58,15 @@ def create_app(config_class=Config):
         logging.error(f'服务器内部错误: {str(error)}')
         return error_response('服务器内部错误', 'INTERNAL_ERROR', 500)
 
+    @app.errorhandler(HTTPException)
+    def handle_http_exception(e):
+        """其余 HTTP 错误（405、413 等）统一返回 JSON"""
+        return error_response(e.description or '请求失败', 'ERROR', e.code or 500)
+
     @app.errorhandler(Exception)
     def handle_exception(e):
         """捕获所有未处理的异常，确保返回JSON格式"""
         logging.error(f'未处理的异常: {str(e)}', exc_info=True)
         return error_response('服务器错误，请稍后重试', 'INTERNAL_ERROR', 500)
 
-    @app.after_request
-    def after_request(response):
-        """确保所有响应都包含正确的Content-Type"""
-        if response.content_type and 'application/json' not in response.content_type:
-            # 如果是错误响应且不是JSON，尝试转换为JSON
-            if response.status_code >= 400:
-                try:
-                    data = response.get_data(as_text=True)
-                    # 如果响应不是JSON，创建一个JSON错误响应
-                    return jsonify({
-                        'success': False,
-                        'message': data or '请求失败',
-                        'error_code': 'ERROR',
-                        'timestamp': datetime.utcnow().isoformat() + 'Z'
-                    }), response.status_code
-                except:
-                    pass
-        return response
-
     return app
@@ -1,33 +1,51 @@
-from flask import Blueprint, request, current_app
+from flask import Blueprint, request
 import logging
+from typing import TypedDict
 from ..core.db import execute_query, execute_update
-from ..core.auth_utils import hash_password, check_password, generate_token, require_auth
-from ..core.utils import success_response, error_response
+from ..core.auth_utils import hash_password, check_password, password_needs_rehash, check_dummy_password, generate_token, revoke_user_tokens, require_auth
+from ..core.utils import success_response, error_response, submit_background, parse_body
+from ..core.config import SETTINGS
 from ..services.agent_service import agent_service
 
 logger = logging.getLogger(__name__)
 
 auth_bp = Blueprint('auth', __name__, url_prefix='/api/auth')
 
+class RegisterRequest(TypedDict):
+    username: str
+    email: str
+    password: str
+
+class LoginRequest(TypedDict):
+    username: str
+    password: str
+
+class UpdateUserRequest(TypedDict, total=False):
+    username: str
+    email: str
+
+class UpdatePasswordRequest(TypedDict):
+    old_password: str
+    new_password: str
+
 @auth_bp.route('/register', methods=['POST'])
 def register():
     """用户注册"""
     try:
-        data = request.get_json()
-        
-        if not data or not data.get('username') or not data.get('email') or not data.get('password'):
-            return error_response('缺少必需字段：username, email, password', 'VALIDATION_ERROR', 400)
+        data, error = parse_body(RegisterRequest)
+        if error:
+            return error_response(error, 'VALIDATION_ERROR', 400)
         
         username = data['username'].strip()
         email = data['email'].strip().lower()
         password = data['password']
         
         # 验证
-        if len(username) < 3 or len(username) > current_app.config['MAX_USERNAME_LENGTH']:
-            return error_response(f'用户名长度必须在3-{current_app.config["MAX_USERNAME_LENGTH"]}个字符之间', 'VALIDATION_ERROR', 400)
+        if len(username) < 3 or len(username) > SETTINGS.max_username_length:
+            return error_response(SETTINGS.err_username_length, 'VALIDATION_ERROR', 400)
         
-        if len(email) > current_app.config['MAX_EMAIL_LENGTH']:
-            return error_response(f'邮箱长度不能超过{current_app.config["MAX_EMAIL_LENGTH"]}个字符', 'VALIDATION_ERROR', 400)
+        if len(email) > SETTINGS.max_email_length:
+            return error_response(SETTINGS.err_email_length, 'VALIDATION_ERROR', 400)
         
         if len(password) < 8:
             return error_response('密码长度至少8个字符', 'VALIDATION_ERROR', 400)
@@ -59,33 +77,35 @@ def register():
 def login():
     """用户登录 (增加预热)"""
     try:
-        data = request.get_json()
-        if not data or not data.get('username') or not data.get('password'):
-            return error_response('缺少必需字段：username, password', 'VALIDATION_ERROR', 400)
+        data, error = parse_body(LoginRequest)
+        if error:
+            return error_response(error, 'VALIDATION_ERROR', 400)
         
         username = data['username'].strip()
         password = data['password']
         
-        user = execute_query('SELECT * FROM users WHERE username = ? OR email = ?', (username, username))
+        user = execute_query('SELECT id, username, email, password_hash, token_version FROM users WHERE username = ? OR email = ?', (username, username))
         if not user:
+            check_dummy_password(password)
             return error_response('用户名或密码错误', 'INVALID_CREDENTIALS', 401)
         
-        user = dict(user[0])
+        user = user[0]
         if not check_password(password, user['password_hash']):
             return error_response('用户名或密码错误', 'INVALID_CREDENTIALS', 401)
         
-        token = generate_token(user['id'])
+        # 旧格式或低成本哈希在登录成功时透明升级
+        if password_needs_rehash(user['password_hash']):
+            execute_update('UPDATE users SET password_hash = ? WHERE id = ?', (hash_password(password), user['id']))
         
-        # === [新增] 登录成功后预热 ===
-        try:
-            agent_service.warm_up_for_user(user['id'])
-        except: pass
-        # ===========================
+        token, expires_in = generate_token(user['id'], user['token_version'] or 0)
+        
+        # 登录成功后在后台预热，不阻塞响应
+        submit_background(agent_service.warm_up_for_user, user['id'])
 
         return success_response({
             'access_token': token,
             'token_type': 'Bearer',
-            'expires_in': int(current_app.config['JWT_EXPIRATION_DELTA'].total_seconds()),
+            'expires_in': expires_in,
             'user': {'id': user['id'], 'username': user['username'], 'email': user['email']}
         }, '登录成功')
     except Exception as e:
@@ -100,16 +120,15 @@ def get_current_user():
     if not user:
         return error_response('用户不存在', 'NOT_FOUND', 404)
     
-    user = dict(user[0])
-    return success_response(user)
+    return success_response(user[0])
 
 @auth_bp.route('/me', methods=['PUT'])
 @require_auth
 def update_current_user():
     """更新当前用户信息"""
-    data = request.get_json()
-    if not data:
-        return error_response('缺少请求数据', 'VALIDATION_ERROR', 400)
+    data, error = parse_body(UpdateUserRequest)
+    if error:
+        return error_response(error, 'VALIDATION_ERROR', 400)
     
     update_fields = []
     params = []
@@ -117,8 +136,8 @@ def update_current_user():
     # 允许更新的字段
     if 'username' in data:
         username = data['username'].strip()
-        if len(username) < 3 or len(username) > current_app.config['MAX_USERNAME_LENGTH']:
-            return error_response(f'用户名长度必须在3-{current_app.config["MAX_USERNAME_LENGTH"]}个字符之间', 'VALIDATION_ERROR', 400)
+        if len(username) < 3 or len(username) > SETTINGS.max_username_length:
+            return error_response(SETTINGS.err_username_length, 'VALIDATION_ERROR', 400)
         # 检查用户名是否已被其他用户使用
         existing = execute_query('SELECT id FROM users WHERE username = ? AND id != ?', (username, request.current_user_id))
         if existing:
@@ -128,8 +147,8 @@ def update_current_user():
     
     if 'email' in data:
         email = data['email'].strip().lower()
-        if len(email) > current_app.config['MAX_EMAIL_LENGTH']:
-            return error_response(f'邮箱长度不能超过{current_app.config["MAX_EMAIL_LENGTH"]}个字符', 'VALIDATION_ERROR', 400)
+        if len(email) > SETTINGS.max_email_length:
+            return error_response(SETTINGS.err_email_length, 'VALIDATION_ERROR', 400)
         # 检查邮箱是否已被其他用户使用
         existing = execute_query('SELECT id FROM users WHERE email = ? AND id != ?', (email, request.current_user_id))
         if existing:
@@ -148,7 +167,7 @@ def update_current_user():
         tuple(params)
     )
     
-    user = dict(execute_query('SELECT id, username, email, created_at FROM users WHERE id = ?', (request.current_user_id,))[0])
+    user = execute_query('SELECT id, username, email, created_at FROM users WHERE id = ?', (request.current_user_id,))[0]
     logger.info(f'用户信息更新成功: user_id={request.current_user_id}')
     return success_response(user, '用户信息更新成功')
 
@@ -156,9 +175,9 @@ def update_current_user():
 @require_auth
 def update_password():
     """修改密码"""
-    data = request.get_json()
-    if not data or not data.get('old_password') or not data.get('new_password'):
-        return error_response('缺少必需字段：old_password, new_password', 'VALIDATION_ERROR', 400)
+    data, error = parse_body(UpdatePasswordRequest)
+    if error:
+        return error_response(error, 'VALIDATION_ERROR', 400)
     
     old_password = data['old_password']
     new_password = data['new_password']
@@ -176,26 +195,33 @@ def update_password():
         logger.warning(f'修改密码失败：原密码错误 - user_id={request.current_user_id}')
         return error_response('原密码错误', 'INVALID_PASSWORD', 401)
     
-    # 更新密码
+    # 更新密码，同时递增 token 版本以吊销已签发的 token
     new_password_hash = hash_password(new_password)
     execute_update(
-        'UPDATE users SET password_hash = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+        'UPDATE users SET password_hash = ?, token_version = token_version + 1, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
         (new_password_hash, request.current_user_id)
     )
+    revoke_user_tokens(request.current_user_id)
     
+    # 为当前会话签发新 token，避免修改密码后被登出
+    new_token, expires_in = generate_token(request.current_user_id)
     logger.info(f'密码修改成功: user_id={request.current_user_id}')
-    return success_response(None, '密码修改成功')
+    return success_response({
+        'access_token': new_token,
+        'token_type': 'Bearer',
+        'expires_in': expires_in
+    }, '密码修改成功')
 
 @auth_bp.route('/refresh', methods=['POST'])
 @require_auth
 def refresh_token():
     """刷新Token"""
-    # 生成新的token
-    new_token = generate_token(request.current_user_id)
+    # 跳过已签发缓存，始终签发新 token 以延长会话
+    new_token, expires_in = generate_token(request.current_user_id, reuse=False)
     
     logger.info(f'Token刷新成功: user_id={request.current_user_id}')
     return success_response({
         'access_token': new_token,
         'token_type': 'Bearer',
-        'expires_in': int(current_app.config['JWT_EXPIRATION_DELTA'].total_seconds())
+        'expires_in': expires_in
     }, 'Token刷新成功')
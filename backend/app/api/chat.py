@@ -1,20 +1,111 @@
-from flask import Blueprint, request, Response, stream_with_context, current_app
+from flask import Blueprint, request, Response, current_app
 import logging
-import json
-from ..core.db import execute_query, execute_update
+import queue
+import threading
+import orjson
+from collections import OrderedDict, deque
+from typing import Dict, List, Tuple, TypedDict
+from ..core.db import get_conn, execute_query, execute_update, execute_returning, execute_transaction, transaction
 from ..core.auth_utils import require_auth
-from ..core.utils import success_response, error_response, verify_resource_ownership, get_pagination_params
+from ..core.config import SETTINGS
+from ..core.utils import success_response, error_response, verify_resource_ownership, fetch_owned, submit_background, parse_body, get_pagination_params, encode_cursor, decode_cursor
 from ..services.agent_service import agent_service
 
 logger = logging.getLogger(__name__)
 
 chat_bp = Blueprint('chat', __name__, url_prefix='/api/conversations')
 
+class ConversationRequest(TypedDict, total=False):
+    title: str
+
+class BatchDeleteRequest(TypedDict):
+    conversation_ids: List[int]
+
+class SendMessageRequest(TypedDict):
+    content: str
+
+class UpdateMessageRequest(TypedDict):
+    content: str
+
+# 对话历史窗口缓存：conversation_id -> deque[(role, content)]，热点对话无需每轮查库
+HISTORY_WINDOW = 19
+_HISTORY_CACHE_MAXSIZE = 512
+_history_cache: 'OrderedDict[int, deque]' = OrderedDict()
+_history_lock = threading.Lock()
+
+def _get_history(conversation_id: int) -> List[Tuple[str, str]]:
+    """获取最近的历史消息 [(role, content)]（不含本轮用户消息），未命中时从数据库预热"""
+    with _history_lock:
+        window = _history_cache.get(conversation_id)
+        if window is not None:
+            _history_cache.move_to_end(conversation_id)
+            return list(window)
+
+    # 只取 role/content 两列且不含时间戳，直接按位置解包，跳过行对象转换与按列名查找
+    rows = get_conn().execute(
+        'SELECT role, content FROM messages WHERE conversation_id = ? ORDER BY created_at DESC, id DESC LIMIT ?',
+        (conversation_id, HISTORY_WINDOW)
+    ).fetchall()
+    window = deque(((role, content) for role, content in reversed(rows)), maxlen=HISTORY_WINDOW)
+    with _history_lock:
+        _history_cache[conversation_id] = window
+        while len(_history_cache) > _HISTORY_CACHE_MAXSIZE:
+            _history_cache.popitem(last=False)
+    return list(window)
+
+def _append_history(conversation_id: int, role: str, content: str):
+    with _history_lock:
+        window = _history_cache.get(conversation_id)
+        if window is not None:
+            window.append((role, content))
+
+def _auto_title(content: str) -> str:
+    """由首条消息生成对话标题：只取第一行，避免多行标题"""
+    lines = content.strip().splitlines()
+    return lines[0][:30] if lines else '新对话'
+
+# 流结束哨兵
+_STREAM_END = object()
+
+def _sse_frame(event: str, payload: Dict) -> bytes:
+    """预序列化 SSE 帧，直接产出 bytes 省去 str 编码"""
+    return b'event: ' + event.encode() + b'\ndata: ' + orjson.dumps(payload) + b'\n\n'
+
+def _invalidate_history(*conversation_ids: int):
+    with _history_lock:
+        for conversation_id in conversation_ids:
+            _history_cache.pop(conversation_id, None)
+
 @chat_bp.route('', methods=['GET'])
 @require_auth
 def get_conversations():
-    """获取对话列表"""
+    """获取对话列表（传 cursor 使用游标分页，否则沿用页码分页）"""
     page, limit, offset = get_pagination_params(20, 100)
+    cursor_param = request.args.get('cursor')
+    if cursor_param is not None:
+        params = [request.current_user_id]
+        where = 'user_id = ?'
+        if cursor_param:
+            cursor = decode_cursor(cursor_param)
+            if not cursor:
+                return error_response('cursor 格式无效', 'VALIDATION_ERROR', 400)
+            where += ' AND (updated_at, id) < (?, ?)'
+            params.extend(cursor)
+        rows = execute_query(
+            f'SELECT * FROM conversations WHERE {where} ORDER BY updated_at DESC, id DESC LIMIT ?',
+            tuple(params + [limit + 1])
+        )
+        conversations = rows[:limit]
+        has_next = len(rows) > limit
+        return success_response({
+            'conversations': conversations,
+            'pagination': {
+                'limit': limit,
+                'has_next': has_next,
+                'next_cursor': encode_cursor(conversations[-1]['updated_at'], conversations[-1]['id']) if has_next else None
+            }
+        })
+    
     conversations = execute_query(
         '''SELECT * FROM conversations WHERE user_id = ? ORDER BY updated_at DESC LIMIT ? OFFSET ?''',
         (request.current_user_id, limit, offset)
@@ -23,7 +114,7 @@ def get_conversations():
     total = total_result[0]['count'] if total_result else 0
     
     return success_response({
-        'conversations': [dict(c) for c in conversations],
+        'conversations': conversations,
         'pagination': {
             'page': page,
             'limit': limit,
@@ -38,27 +129,24 @@ def get_conversations():
 @require_auth
 def create_conversation():
     """创建对话"""
-    data = request.get_json() or {}
+    data, error = parse_body(ConversationRequest, allow_empty=True)
+    if error:
+        return error_response(error, 'VALIDATION_ERROR', 400)
     title = data.get('title', '新对话')
     
-    conversation_id = execute_update(
-        'INSERT INTO conversations (user_id, title) VALUES (?, ?)',
+    conversation = execute_returning(
+        'INSERT INTO conversations (user_id, title) VALUES (?, ?) RETURNING *',
         (request.current_user_id, title)
-    )
-    
-    conversation = dict(execute_query('SELECT * FROM conversations WHERE id = ?', (conversation_id,))[0])
+    )[0]
     return success_response(conversation, '对话创建成功')
 
 @chat_bp.route('/<int:conversation_id>', methods=['PUT'])
 @require_auth
 def update_conversation(conversation_id):
     """更新对话"""
-    if not verify_resource_ownership('conversations', conversation_id, request.current_user_id):
-        return error_response('对话不存在或无权限', 'NOT_FOUND', 404)
-    
-    data = request.get_json()
-    if not data:
-        return error_response('缺少请求数据', 'VALIDATION_ERROR', 400)
+    data, error = parse_body(ConversationRequest)
+    if error:
+        return error_response(error, 'VALIDATION_ERROR', 400)
     
     update_fields = []
     params = []
@@ -74,14 +162,16 @@ def update_conversation(conversation_id):
         return error_response('没有要更新的字段', 'VALIDATION_ERROR', 400)
     
     update_fields.append('updated_at = CURRENT_TIMESTAMP')
-    params.append(conversation_id)
+    params.extend([conversation_id, request.current_user_id])
     
-    execute_update(
-        f'UPDATE conversations SET {", ".join(update_fields)} WHERE id = ?',
+    # 归属校验并入 UPDATE 条件，无匹配行即不存在或无权限
+    updated = execute_returning(
+        f'UPDATE conversations SET {", ".join(update_fields)} WHERE id = ? AND user_id = ? RETURNING *',
         tuple(params)
     )
-    
-    conversation = dict(execute_query('SELECT * FROM conversations WHERE id = ?', (conversation_id,))[0])
+    if not updated:
+        return error_response('对话不存在或无权限', 'NOT_FOUND', 404)
+    conversation = updated[0]
     return success_response(conversation, '对话更新成功')
 
 @chat_bp.route('/<int:conversation_id>', methods=['DELETE'])
@@ -91,43 +181,44 @@ def delete_conversation(conversation_id):
     if not verify_resource_ownership('conversations', conversation_id, request.current_user_id):
         return error_response('对话不存在或无权限', 'NOT_FOUND', 404)
     
-    # 删除对话相关记忆
-    agent_service.delete_conversation_memories(request.current_user_id, conversation_id)
-    
     execute_update('DELETE FROM conversations WHERE id = ?', (conversation_id,))
+    _invalidate_history(conversation_id)
+    
+    # 删除对话相关记忆 (后台执行，SQLite 提交后即返回)
+    submit_background(agent_service.delete_conversation_memories, request.current_user_id, conversation_id)
     return success_response(None, '对话删除成功')
 
 @chat_bp.route('/batch', methods=['DELETE'])
 @require_auth
 def batch_delete_conversations():
     """批量删除对话"""
-    data = request.get_json()
-    if not data or not data.get('conversation_ids'):
-        return error_response('缺少必需字段：conversation_ids', 'VALIDATION_ERROR', 400)
+    data, error = parse_body(BatchDeleteRequest)
+    if error:
+        return error_response(error, 'VALIDATION_ERROR', 400)
     
     conversation_ids = data['conversation_ids']
-    if not isinstance(conversation_ids, list) or len(conversation_ids) == 0:
-        return error_response('conversation_ids必须是非空数组', 'VALIDATION_ERROR', 400)
     
     # 限制批量删除数量，防止资源耗尽
     if len(conversation_ids) > 100:
         return error_response('批量删除数量不能超过100', 'VALIDATION_ERROR', 400)
     
-    # 验证所有对话都属于当前用户
+    # 验证所有对话都属于当前用户并批量删除 (单事务)
     placeholders = ','.join(['?'] * len(conversation_ids))
-    conversations = execute_query(
-        f'SELECT id FROM conversations WHERE id IN ({placeholders}) AND user_id = ?',
-        tuple(conversation_ids + [request.current_user_id])
-    )
-    
-    if len(conversations) != len(conversation_ids):
-        return error_response('部分对话不存在或无权限', 'FORBIDDEN', 403)
-    
-    # 批量删除
-    execute_update(
-        f'DELETE FROM conversations WHERE id IN ({placeholders})',
-        tuple(conversation_ids)
-    )
+    with transaction() as conn:
+        conversations = conn.execute(
+            f'SELECT id FROM conversations WHERE id IN ({placeholders}) AND user_id = ?',
+            tuple(conversation_ids + [request.current_user_id])
+        ).fetchall()
+        if len(conversations) != len(conversation_ids):
+            return error_response('部分对话不存在或无权限', 'FORBIDDEN', 403)
+        conn.execute(
+            f'DELETE FROM conversations WHERE id IN ({placeholders})',
+            tuple(conversation_ids)
+        )
+    _invalidate_history(*conversation_ids)
+    
+    # 删除对话相关记忆 (一次批量调用，事务提交后在后台执行)
+    submit_background(agent_service.delete_conversation_memories_bulk, request.current_user_id, conversation_ids)
     
     logger.info(f'批量删除对话成功: user_id={request.current_user_id}, count={len(conversation_ids)}')
     return success_response({'deleted_count': len(conversation_ids)}, '批量删除成功')
@@ -139,6 +230,30 @@ def get_messages(conversation_id):
     if not verify_resource_ownership('conversations', conversation_id, request.current_user_id):
         return error_response('对话不存在或无权限', 'NOT_FOUND', 404)
     page, limit, offset = get_pagination_params(50, 100)
+    cursor_param = request.args.get('cursor')
+    if cursor_param is not None:
+        params = [conversation_id]
+        where = 'conversation_id = ?'
+        if cursor_param:
+            cursor = decode_cursor(cursor_param)
+            if not cursor:
+                return error_response('cursor 格式无效', 'VALIDATION_ERROR', 400)
+            where += ' AND (created_at, id) > (?, ?)'
+            params.extend(cursor)
+        rows = execute_query(
+            f'SELECT * FROM messages WHERE {where} ORDER BY created_at ASC, id ASC LIMIT ?',
+            tuple(params + [limit + 1])
+        )
+        messages = rows[:limit]
+        has_next = len(rows) > limit
+        return success_response({
+            'messages': messages,
+            'pagination': {
+                'limit': limit,
+                'has_next': has_next,
+                'next_cursor': encode_cursor(messages[-1]['created_at'], messages[-1]['id']) if has_next else None
+            }
+        })
     messages = execute_query(
         '''SELECT * FROM messages WHERE conversation_id = ? ORDER BY created_at ASC LIMIT ? OFFSET ?''',
         (conversation_id, limit, offset)
@@ -146,7 +261,7 @@ def get_messages(conversation_id):
     total_result = execute_query('SELECT COUNT(*) as count FROM messages WHERE conversation_id = ?', (conversation_id,))
     total = total_result[0]['count'] if total_result else 0
     return success_response({
-        'messages': [dict(m) for m in messages],
+        'messages': messages,
         'pagination': {
             'page': page,
             'limit': limit,
@@ -159,25 +274,24 @@ def get_messages(conversation_id):
 @require_auth
 def send_message(conversation_id):
     """发送消息 - Agentic 模式 (逻辑已替换)"""
-    data = request.get_json()
-    content = data.get('content', '').strip()
+    data, error = parse_body(SendMessageRequest)
+    if error:
+        return error_response(error, 'VALIDATION_ERROR', 400)
+    content = data['content'].strip()
     if not content: return error_response('内容不能为空', 'VALIDATION_ERROR', 400)
     
     if not verify_resource_ownership('conversations', conversation_id, request.current_user_id):
         return error_response('无权限', 'NOT_FOUND', 404)
     
-    # 1. 保存用户消息
-    user_message_id = execute_update(
-        'INSERT INTO messages (conversation_id, role, content) VALUES (?, ?, ?)',
-        (conversation_id, 'user', content)
-    )
+    # 1. 准备历史 (在写入本轮消息之前读取，无需再去重)
+    history = _get_history(conversation_id)
     
-    # 2. 准备历史 (去重)
-    history_messages = execute_query(
-        'SELECT role, content FROM messages WHERE conversation_id = ? ORDER BY created_at ASC LIMIT 20',
-        (conversation_id,)
-    )
-    history = [{'role': m['role'], 'content': m['content']} for m in history_messages[:-1]]
+    # 2. 保存用户消息
+    user_message = execute_returning(
+        'INSERT INTO messages (conversation_id, role, content) VALUES (?, ?, ?) RETURNING *',
+        (conversation_id, 'user', content)
+    )[0]
+    _append_history(conversation_id, 'user', content)
     
     # 3. Agent 思考与执行 (这就是你要的逻辑)
     assistant_content = agent_service.chat_agent(
@@ -187,156 +301,172 @@ def send_message(conversation_id):
         history_messages=history
     )
     
-    # 4. 保存 AI 回答
-    assistant_message_id = execute_update(
-        'INSERT INTO messages (conversation_id, role, content) VALUES (?, ?, ?)',
-        (conversation_id, 'assistant', assistant_content)
-    )
-    
-    # 5. 更新元数据
-    execute_update(
-        'UPDATE conversations SET message_count = message_count + 2, last_message_at = CURRENT_TIMESTAMP WHERE id = ?',
-        (conversation_id,)
-    )
-    
-    # 自动标题
-    conversation_data = dict(execute_query('SELECT title FROM conversations WHERE id = ?', (conversation_id,))[0])
-    if not conversation_data.get('title') or conversation_data['title'] == '新对话':
-        execute_update('UPDATE conversations SET title = ? WHERE id = ?', (content[:30], conversation_id))
+    # 4. 保存 AI 回答 + 更新元数据与自动标题 (单事务)
+    assistant_rows, _ = execute_transaction([
+        (
+            'INSERT INTO messages (conversation_id, role, content) VALUES (?, ?, ?) RETURNING *',
+            (conversation_id, 'assistant', assistant_content)
+        ),
+        (
+            """UPDATE conversations SET message_count = message_count + 2, last_message_at = CURRENT_TIMESTAMP,
+               title = CASE WHEN title IS NULL OR title IN ('新对话', '') THEN ? ELSE title END
+               WHERE id = ?""",
+            (_auto_title(content), conversation_id)
+        )
+    ])
+    _append_history(conversation_id, 'assistant', assistant_content)
     
     return success_response({
-        'user_message': dict(execute_query('SELECT * FROM messages WHERE id = ?', (user_message_id,))[0]),
-        'assistant_message': dict(execute_query('SELECT * FROM messages WHERE id = ?', (assistant_message_id,))[0])
+        'user_message': user_message,
+        'assistant_message': assistant_rows[0]
     })
 
 @chat_bp.route('/<int:conversation_id>/messages/stream', methods=['POST'])
 @require_auth
 def send_message_stream(conversation_id):
     """流式发送消息 - Agent 适配版"""
-    # 注意：为了支持 Tool Call 循环，这里我们采用"伪流式"。
-    # 即：服务器先执行完完整的 Agent 思考过程（可能包含多次搜索/存储），
-    # 拿到最终文本后，再以流的形式吐给前端。这样前端代码不用改。
+    # Agent 以 stream=True 调用模型，token 一到即转发给前端；
+    # 中间的 Tool Call 轮次以 tool 事件穿插，前端按 type 分发，忽略未知事件。
     
-    data = request.get_json()
-    if not data or not data.get('content'):
-        return error_response('缺少必需字段：content', 'VALIDATION_ERROR', 400)
+    data, error = parse_body(SendMessageRequest)
+    if error:
+        return error_response(error, 'VALIDATION_ERROR', 400)
     
     content = data['content'].strip()
     if not verify_resource_ownership('conversations', conversation_id, request.current_user_id):
         return error_response('对话不存在或无权限', 'NOT_FOUND', 404)
     
+    # 在请求线程内完成历史读取与用户消息写入；Agent 在独立线程中运行，
+    # 通过队列把预序列化的 SSE 帧交给生成器，生成器不再依赖请求上下文
+    frames = queue.SimpleQueue()
+    try:
+        # 1. 准备历史 (在写入本轮消息之前读取)
+        history = _get_history(conversation_id)
+        
+        # 2. 保存用户消息
+        user_message_id = execute_update(
+            'INSERT INTO messages (conversation_id, role, content) VALUES (?, ?, ?)',
+            (conversation_id, 'user', content)
+        )
+        _append_history(conversation_id, 'user', content)
+        # 发送用户消息事件
+        frames.put(_sse_frame('user_message', {'type': 'user_message', 'message_id': user_message_id, 'content': content}))
+        
+        threading.Thread(
+            target=_run_agent_stream,
+            args=(current_app._get_current_object(), frames, request.current_user_id, conversation_id, content, history),
+            name=f'agent-stream-{conversation_id}',
+            daemon=True
+        ).start()
+    except Exception as e:
+        logger.error(f'Agent 流式处理失败: {str(e)}', exc_info=True)
+        frames.put(_sse_frame('error', {'type': 'error', 'message': '智能体处理失败', 'error_code': 'INTERNAL_ERROR'}))
+        frames.put(_STREAM_END)
+    
     def generate():
+        while True:
+            frame = frames.get()
+            if frame is _STREAM_END:
+                break
+            yield frame
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+def _run_agent_stream(app, frames: queue.SimpleQueue, user_id: int, conversation_id: int, content: str, history: List[Tuple[str, str]]):
+    """Agent 工作线程：逐 token 写入队列，结束后落库并发送 done 事件"""
+    with app.app_context():
         try:
-            # 1. 保存用户消息
-            user_message_id = execute_update(
-                'INSERT INTO messages (conversation_id, role, content) VALUES (?, ?, ?)',
-                (conversation_id, 'user', content)
-            )
-            # 发送用户消息事件
-            yield f"event: user_message\ndata: {json.dumps({'type': 'user_message', 'message_id': user_message_id, 'content': content})}\n\n"
-            
-            # 2. 准备历史
-            history_messages = execute_query(
-                'SELECT role, content FROM messages WHERE conversation_id = ? ORDER BY created_at ASC LIMIT 20',
-                (conversation_id,)
-            )
-            history = [{'role': m['role'], 'content': m['content']} for m in history_messages[:-1]]
-            
-            # 3. 【核心】执行 Agent 思考 (这步会阻塞，直到思考完成)
+            # 3. 【核心】流式执行 Agent 思考，逐 token 转发
             # 在这里，Agent 可能会调用 add_memory 存入数据库
-            final_content = agent_service.chat_agent(
-                user_id=request.current_user_id,
+            buf = []
+            for event in agent_service.chat_agent_stream(
+                user_id=user_id,
                 conversation_id=conversation_id,
                 user_message=content,
                 history_messages=history
-            )
-            
-            # 4. 模拟流式输出最终结果 (为了兼容前端动画)
-            # 将结果切片发送
-            chunk_size = 10
-            for i in range(0, len(final_content), chunk_size):
-                chunk = final_content[i:i+chunk_size]
-                yield f"event: token\ndata: {json.dumps({'type': 'token', 'content': chunk})}\n\n"
+            ):
+                if event['type'] == 'token':
+                    buf.append(event['content'])
+                elif event['type'] == 'tool':
+                    # 已收到的 token 属于调用工具的中间轮次，只保存最终（无工具调用）轮次的回答，与 chat_agent 一致
+                    buf.clear()
+                frames.put(_sse_frame(event['type'], event))
+            final_content = ''.join(buf)
             
-            # 5. 保存 AI 完整回答
-            assistant_message_id = execute_update(
-                'INSERT INTO messages (conversation_id, role, content) VALUES (?, ?, ?)',
-                (conversation_id, 'assistant', final_content)
-            )
-            execute_update(
-                'UPDATE conversations SET message_count = message_count + 2, last_message_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
-                (conversation_id,)
-            )
+            # 4. 保存 AI 完整回答 + 更新元数据与自动标题 (单事务)
+            assistant_rows, _ = execute_transaction([
+                (
+                    'INSERT INTO messages (conversation_id, role, content) VALUES (?, ?, ?) RETURNING id',
+                    (conversation_id, 'assistant', final_content)
+                ),
+                (
+                    """UPDATE conversations SET message_count = message_count + 2, last_message_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP,
+                       title = CASE WHEN title IS NULL OR title IN ('新对话', '') THEN ? ELSE title END
+                       WHERE id = ?""",
+                    (_auto_title(content), conversation_id)
+                )
+            ])
+            assistant_message_id = assistant_rows[0]['id']
+            _append_history(conversation_id, 'assistant', final_content)
             
-            yield f"event: done\ndata: {json.dumps({'type': 'done', 'message_id': assistant_message_id})}\n\n"
+            frames.put(_sse_frame('done', {'type': 'done', 'message_id': assistant_message_id}))
             
         except Exception as e:
             logger.error(f'Agent 流式处理失败: {str(e)}', exc_info=True)
-            yield f"event: error\ndata: {json.dumps({'type': 'error', 'message': '智能体处理失败', 'error_code': 'INTERNAL_ERROR'})}\n\n"
-
-    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
-        'Cache-Control': 'no-cache',
-        'X-Accel-Buffering': 'no'
-    })
+            frames.put(_sse_frame('error', {'type': 'error', 'message': '智能体处理失败', 'error_code': 'INTERNAL_ERROR'}))
+        finally:
+            frames.put(_STREAM_END)
 
 @chat_bp.route('/<int:conversation_id>/messages/<int:message_id>', methods=['PUT'])
 @require_auth
 def update_message(conversation_id, message_id):
     """更新消息"""
-    if not verify_resource_ownership('conversations', conversation_id, request.current_user_id):
-        return error_response('对话不存在或无权限', 'NOT_FOUND', 404)
-    
-    data = request.get_json()
-    if not data or not data.get('content'):
-        return error_response('缺少必需字段：content', 'VALIDATION_ERROR', 400)
+    data, error = parse_body(UpdateMessageRequest)
+    if error:
+        return error_response(error, 'VALIDATION_ERROR', 400)
     
     content = data['content'].strip()
     if not content:
         return error_response('消息内容不能为空', 'VALIDATION_ERROR', 400)
-    if len(content) > current_app.config['MAX_MESSAGE_LENGTH']:
-        return error_response(f'消息内容长度不能超过{current_app.config["MAX_MESSAGE_LENGTH"]}个字符', 'VALIDATION_ERROR', 400)
+    if len(content) > SETTINGS.max_message_length:
+        return error_response(SETTINGS.err_message_length, 'VALIDATION_ERROR', 400)
     
-    # 验证消息属于该对话
-    message = execute_query(
-        'SELECT * FROM messages WHERE id = ? AND conversation_id = ?',
-        (message_id, conversation_id)
-    )
-    if not message:
+    # 验证消息属于该用户的该对话 (单次查询)
+    message = fetch_owned('messages', message_id, request.current_user_id)
+    if not message or message['conversation_id'] != conversation_id:
         return error_response('消息不存在', 'NOT_FOUND', 404)
     
     # 只允许更新用户消息
-    if message[0]['role'] != 'user':
+    if message['role'] != 'user':
         return error_response('只能编辑用户消息', 'FORBIDDEN', 403)
     
-    execute_update(
-        'UPDATE messages SET content = ? WHERE id = ?',
+    updated_message = execute_returning(
+        'UPDATE messages SET content = ? WHERE id = ? RETURNING *',
         (content, message_id)
-    )
-    
-    updated_message = dict(execute_query('SELECT * FROM messages WHERE id = ?', (message_id,))[0])
+    )[0]
+    _invalidate_history(conversation_id)
     return success_response(updated_message, '消息更新成功')
 
 @chat_bp.route('/<int:conversation_id>/messages/<int:message_id>', methods=['DELETE'])
 @require_auth
 def delete_message(conversation_id, message_id):
     """删除消息"""
-    if not verify_resource_ownership('conversations', conversation_id, request.current_user_id):
-        return error_response('对话不存在或无权限', 'NOT_FOUND', 404)
-    
-    # 验证消息属于该对话
-    message = execute_query(
-        'SELECT * FROM messages WHERE id = ? AND conversation_id = ?',
-        (message_id, conversation_id)
-    )
-    if not message:
+    # 验证消息属于该用户的该对话 (单次查询)
+    message = fetch_owned('messages', message_id, request.current_user_id)
+    if not message or message['conversation_id'] != conversation_id:
         return error_response('消息不存在', 'NOT_FOUND', 404)
     
-    execute_update('DELETE FROM messages WHERE id = ?', (message_id,))
-    
-    # 更新对话的消息计数
-    execute_update(
-        'UPDATE conversations SET message_count = message_count - 1, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
-        (conversation_id,)
-    )
+    # 删除消息并更新对话的消息计数 (单事务)
+    execute_transaction([
+        ('DELETE FROM messages WHERE id = ?', (message_id,)),
+        (
+            'UPDATE conversations SET message_count = message_count - 1, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+            (conversation_id,)
+        )
+    ])
+    _invalidate_history(conversation_id)
     
     return success_response(None, '消息删除成功')
\ No newline at end of file
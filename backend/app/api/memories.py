@@ -1,16 +1,140 @@
 from flask import Blueprint, request, current_app
 import logging
-import json
+import re
+import threading
+import time
+import orjson
+from collections import OrderedDict
 from datetime import datetime
-from ..core.db import execute_query, execute_update
+from typing import Any, Dict, List, Optional, Tuple, TypedDict, Union
+from ..core.db import execute_update, execute_returning
 from ..core.auth_utils import require_auth
-from ..core.utils import success_response, error_response, verify_resource_ownership
-from ..services.agent_service import agent_service
+from ..core.config import SETTINGS
+from ..core.utils import success_response, error_response, verify_resource_ownership, submit_background, parse_body
+from ..services.agent_service import agent_service, MemoryManager
 
 logger = logging.getLogger(__name__)
 
 memories_bp = Blueprint('memories', __name__, url_prefix='/api/memories')
 
+# conversation_id 兼容数字字符串，由处理函数转换为整数
+class UpdateMemoryRequest(TypedDict, total=False):
+    title: str
+    content: str
+    conversation_id: Union[int, str]
+    memory_type: str
+    category: str
+    tags: Union[List[str], str]
+    metadata: Dict[str, Any]
+
+class CreateMemoryRequest(UpdateMemoryRequest):
+    title: str
+    content: str
+
+class _SearchMemoriesFields(TypedDict, total=False):
+    limit: int
+
+class SearchMemoriesRequest(_SearchMemoriesFields):
+    query: str
+    conversation_id: Union[int, str]
+
+# 未启用记忆系统（或读取失败）时的空列表响应体，预先序列化
+_EMPTY_MEMORIES_BODY = orjson.dumps({
+    'success': True,
+    'message': '操作成功',
+    'data': {'memories': [], 'relations': [], 'pagination': {}}
+})
+
+def _empty_memories_response():
+    return current_app.response_class(_EMPTY_MEMORIES_BODY, mimetype='application/json')
+
+# 换行符规范化：\r\n 与单独的 \r 一次替换为 \n
+_CRLF_RE = re.compile(r'\r\n?')
+
+def _normalize_newlines(text: str) -> str:
+    return _CRLF_RE.sub('\n', text) if '\r' in text else text
+
+def _to_conversation_id(value) -> Optional[int]:
+    """mem0 元数据中的 source_conversation_id（字符串或整数）转为 int，无效时返回 None"""
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def _format_memory(m: Dict, now_iso: str) -> Dict:
+    """mem0 返回的单条记忆 -> 前端记忆列表项"""
+    content = m.get('memory', m.get('text', ''))
+    metadata = m.get('metadata') or {}
+    meta_get = metadata.get
+    return {
+        'id': m.get('id'),
+        'title': metadata['title'] if 'title' in metadata else content[:50] + '...',
+        'content': content,
+        'category': meta_get('category', '自动生成'),
+        'tags': meta_get('tags'),
+        'conversation_id': _to_conversation_id(meta_get('source_conversation_id')),
+        'created_at': m.get('created_at', now_iso),
+        'updated_at': m.get('updated_at', now_iso)
+    }
+
+# 记忆列表短时缓存：(user_id, run_id, limit) -> (过期时间, 响应数据)，前端轮询时免去向量库/图库查询
+_MEMORY_LIST_CACHE_TTL = 10  # 秒
+_MEMORY_LIST_CACHE_MAXSIZE = 256
+_memory_list_cache: 'OrderedDict[Tuple[int, Optional[str], int], Tuple[float, Dict]]' = OrderedDict()
+_memory_list_lock = threading.Lock()
+
+def _get_cached_memory_list(key: Tuple[int, Optional[str], int]) -> Optional[Dict]:
+    with _memory_list_lock:
+        entry = _memory_list_cache.get(key)
+        if entry is None:
+            return None
+        expires_at, data = entry
+        if time.monotonic() >= expires_at:
+            del _memory_list_cache[key]
+            return None
+        _memory_list_cache.move_to_end(key)
+        return data
+
+def _cache_memory_list(key: Tuple[int, Optional[str], int], data: Dict):
+    with _memory_list_lock:
+        _memory_list_cache[key] = (time.monotonic() + _MEMORY_LIST_CACHE_TTL, data)
+        _memory_list_cache.move_to_end(key)
+        while len(_memory_list_cache) > _MEMORY_LIST_CACHE_MAXSIZE:
+            _memory_list_cache.popitem(last=False)
+
+def _invalidate_memory_list(user_id: int):
+    """记忆增删改后清除该用户的所有列表缓存"""
+    with _memory_list_lock:
+        for key in [k for k in _memory_list_cache if k[0] == user_id]:
+            del _memory_list_cache[key]
+
+def _on_memories_changed(user_id: Optional[str]):
+    """MemoryManager 写入回调：智能体工具、后台删除对话等非本模块的写入同样令列表缓存失效"""
+    if user_id is None:
+        with _memory_list_lock:
+            _memory_list_cache.clear()
+        return
+    try:
+        _invalidate_memory_list(int(user_id))
+    except ValueError:
+        pass
+
+MemoryManager.add_invalidation_listener(_on_memories_changed)
+
+def _sync_memory(user_id: int, memory_id: int, payload: Dict):
+    """后台任务：同步记忆到智能体系统，并回填 mem0_memory_id"""
+    sync_result = agent_service.sync_memory(user_id, payload)
+    if not isinstance(sync_result, dict):
+        return
+    mem0_id = sync_result.get('id')
+    if not mem0_id and isinstance(sync_result.get('results'), list) and sync_result['results']:
+        mem0_id = sync_result['results'][0].get('id')
+    if mem0_id:
+        execute_update('UPDATE memories SET mem0_memory_id = ? WHERE id = ?', (mem0_id, memory_id))
+        _invalidate_memory_list(user_id)
+
 @memories_bp.route('', methods=['GET'])
 @require_auth
 def get_memories():
@@ -23,9 +147,16 @@ def get_memories():
     if conversation_id and conversation_id != '0':
         run_id = str(conversation_id)
 
+    # ?nocache=1 跳过缓存
+    cache_key = (request.current_user_id, run_id, limit)
+    if request.args.get('nocache') != '1':
+        cached = _get_cached_memory_list(cache_key)
+        if cached is not None:
+            return success_response(cached)
+
     try:
         if not agent_service.memory_manager:
-            return success_response({'memories': [], 'relations': [], 'pagination': {}})
+            return _empty_memories_response()
 
         # 调用 manager
         raw_result = agent_service.memory_manager.get_memories(
@@ -40,26 +171,12 @@ def get_memories():
         results = raw_result.get('results', [])
         relations = raw_result.get('relations', []) # <--- 获取图数据
 
-        # 格式化列表
-        memories_list = []
-        for m in results:
-            if not isinstance(m, dict): continue
-            content = m.get('memory', m.get('text', ''))
-            metadata = m.get('metadata') or {}
-            
-            memories_list.append({
-                'id': m.get('id'),
-                'title': metadata.get('title', content[:50] + '...'),
-                'content': content,
-                'category': metadata.get('category', '自动生成'),
-                'tags': metadata.get('tags'),
-                'conversation_id': int(metadata.get('source_conversation_id', 0)) if metadata.get('source_conversation_id', '').isdigit() else None,
-                'created_at': m.get('created_at', datetime.utcnow().isoformat() + 'Z'),
-                'updated_at': m.get('updated_at', datetime.utcnow().isoformat() + 'Z')
-            })
+        # 格式化列表（缺失时间戳统一用同一个当前时间）
+        now_iso = datetime.utcnow().isoformat() + 'Z'
+        memories_list = [_format_memory(m, now_iso) for m in results if isinstance(m, dict)]
         
         # 返回结果 (带上 relations)
-        return success_response({
+        data = {
             'memories': memories_list,
             'relations': relations, # <--- 关键：传给前端
             'pagination': {
@@ -68,19 +185,21 @@ def get_memories():
                 'total': len(memories_list),
                 'total_pages': 1
             }
-        })
+        }
+        _cache_memory_list(cache_key, data)
+        return success_response(data)
 
     except Exception as e:
         logger.error(f"获取记忆路由失败: {e}", exc_info=True)
-        return success_response({'memories': [], 'relations': [], 'pagination': {}})
+        return _empty_memories_response()
 
 @memories_bp.route('', methods=['POST'])
 @require_auth
 def create_memory():
     """创建记忆（conversation_id 可选，若未提供则为用户级记忆）"""
-    data = request.get_json()
-    if not data or not data.get('title') or not data.get('content'):
-        return error_response('缺少必需字段：title, content', 'VALIDATION_ERROR', 400)
+    data, error = parse_body(CreateMemoryRequest)
+    if error:
+        return error_response(error, 'VALIDATION_ERROR', 400)
 
     conversation_id = data.get('conversation_id')
     conversation_id_int = None
@@ -102,18 +221,18 @@ def create_memory():
     if not content:
         return error_response('记忆内容不能为空', 'VALIDATION_ERROR', 400)
 
-    if len(title) > current_app.config['MAX_MEMORY_TITLE_LENGTH']:
-        return error_response(f'记忆标题长度不能超过{current_app.config["MAX_MEMORY_TITLE_LENGTH"]}个字符', 'VALIDATION_ERROR', 400)
+    if len(title) > SETTINGS.max_memory_title_length:
+        return error_response(SETTINGS.err_memory_title_length, 'VALIDATION_ERROR', 400)
 
-    if len(content) > current_app.config['MAX_MEMORY_CONTENT_LENGTH']:
-        return error_response(f'记忆内容长度不能超过{current_app.config["MAX_MEMORY_CONTENT_LENGTH"]}个字符', 'VALIDATION_ERROR', 400)
+    if len(content) > SETTINGS.max_memory_content_length:
+        return error_response(SETTINGS.err_memory_content_length, 'VALIDATION_ERROR', 400)
 
     # 规范化内容：统一换行符
-    content = content.replace('\r\n', '\n').replace('\r', '\n')
+    content = _normalize_newlines(content)
 
-    memory_id = execute_update(
+    memory = execute_returning(
         '''INSERT INTO memories (user_id, conversation_id, title, content, memory_type, category, tags, metadata)
-           VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?) RETURNING *''',
         (
             request.current_user_id,
             conversation_id_int,
@@ -121,13 +240,14 @@ def create_memory():
             content,
             data.get('memory_type'),
             data.get('category'),
-            json.dumps(data.get('tags', [])) if data.get('tags') else None,
-            json.dumps(data.get('metadata', {})) if data.get('metadata') else None
+            orjson.dumps(data['tags']).decode() if data.get('tags') else None,
+            orjson.dumps(data['metadata']).decode() if data.get('metadata') else None
         )
-    )
+    )[0]
+    memory_id = memory['id']
 
-    # 同步到智能体系统
-    sync_result = agent_service.sync_memory(request.current_user_id, {
+    # 在后台同步到智能体系统（嵌入 + 向量库写入不阻塞响应）
+    submit_background(_sync_memory, request.current_user_id, memory_id, {
         'id': memory_id,
         'conversation_id': conversation_id_int,
         'title': title,
@@ -136,39 +256,33 @@ def create_memory():
         'tags': data.get('tags', [])
     })
 
-    # Update mem0_memory_id if available
-    if isinstance(sync_result, dict):
-        mem0_id = sync_result.get('id')
-        if not mem0_id and 'results' in sync_result and isinstance(sync_result['results'], list) and len(sync_result['results']) > 0:
-             mem0_id = sync_result['results'][0].get('id')
-        
-        if mem0_id:
-             execute_update('UPDATE memories SET mem0_memory_id = ? WHERE id = ?', (mem0_id, memory_id))
-
-    memory = dict(execute_query('SELECT * FROM memories WHERE id = ?', (memory_id,))[0])
+    _invalidate_memory_list(request.current_user_id)
     return success_response(memory, '记忆创建成功')
 
 @memories_bp.route('/<int:memory_id>', methods=['PUT'])
 @require_auth
 def update_memory(memory_id):
     """更新记忆"""
-    data = request.get_json()
-    if not verify_resource_ownership('memories', memory_id, request.current_user_id):
-        return error_response('记忆不存在或无权限', 'NOT_FOUND', 404)
+    data, error = parse_body(UpdateMemoryRequest)
+    if error:
+        return error_response(error, 'VALIDATION_ERROR', 400)
 
-    # 验证对话ID（如果要更改对话）
+    # 验证对话ID（如果要更改对话），归属校验并入下方 UPDATE 的 WHERE 条件
     conversation_id = data.get('conversation_id')
+    conversation_id_int = None
     if conversation_id:
-        if not verify_resource_ownership('conversations', int(conversation_id), request.current_user_id):
-            return error_response('对话不存在或无权限', 'NOT_FOUND', 404)
+        try:
+            conversation_id_int = int(conversation_id)
+        except (ValueError, TypeError):
+            return error_response('conversation_id 必须是有效的整数', 'VALIDATION_ERROR', 400)
 
     update_fields = []
     params = []
 
     # 允许更新的字段列表（防止SQL注入）
     allowed_fields = {
-        'title': current_app.config['MAX_MEMORY_TITLE_LENGTH'],
-        'content': current_app.config['MAX_MEMORY_CONTENT_LENGTH'],
+        'title': SETTINGS.max_memory_title_length,
+        'content': SETTINGS.max_memory_content_length,
         'category': 50,
         'tags': None,  # JSON格式，长度由内容决定
         'memory_type': 50,
@@ -183,17 +297,19 @@ def update_memory(memory_id):
                 if not value:
                     return error_response('记忆标题不能为空', 'VALIDATION_ERROR', 400)
                 if max_length and len(value) > max_length:
-                    return error_response(f'记忆标题长度不能超过{max_length}个字符', 'VALIDATION_ERROR', 400)
+                    return error_response(SETTINGS.err_memory_title_length, 'VALIDATION_ERROR', 400)
             elif field == 'content':
                 value = value.strip()
                 if not value:
                     return error_response('记忆内容不能为空', 'VALIDATION_ERROR', 400)
                 if max_length and len(value) > max_length:
-                    return error_response(f'记忆内容长度不能超过{max_length}个字符', 'VALIDATION_ERROR', 400)
+                    return error_response(SETTINGS.err_memory_content_length, 'VALIDATION_ERROR', 400)
                 # 规范化内容：统一换行符
-                value = value.replace('\r\n', '\n').replace('\r', '\n')
+                value = _normalize_newlines(value)
             elif field == 'tags':
-                value = json.dumps(value) if isinstance(value, list) else value
+                value = orjson.dumps(value).decode() if isinstance(value, list) else value
+            elif field == 'conversation_id' and conversation_id_int is not None:
+                value = conversation_id_int
             update_fields.append(f'{field} = ?')
             params.append(value)
 
@@ -203,54 +319,63 @@ def update_memory(memory_id):
     update_fields.append('updated_at = CURRENT_TIMESTAMP')
     params.append(memory_id)
     params.append(request.current_user_id)
-
-    # 使用安全的字段名列表构建SQL
-    execute_update(
-        f'UPDATE memories SET {", ".join(update_fields)} WHERE id = ? AND user_id = ?',
+    where = 'id = ? AND user_id = ?'
+    if conversation_id_int is not None:
+        where += ' AND ? IN (SELECT id FROM conversations WHERE user_id = ?)'
+        params.extend((conversation_id_int, request.current_user_id))
+
+    # 使用安全的字段名列表构建SQL；记忆与目标对话的归属在同一条语句内校验
+    rows = execute_returning(
+        f'UPDATE memories SET {", ".join(update_fields)} WHERE {where} RETURNING *',
         tuple(params)
     )
+    if not rows:
+        # 未更新任何行：仅在失败路径上区分是记忆还是对话不存在
+        if conversation_id_int is not None and verify_resource_ownership('memories', memory_id, request.current_user_id):
+            return error_response('对话不存在或无权限', 'NOT_FOUND', 404)
+        return error_response('记忆不存在或无权限', 'NOT_FOUND', 404)
+    memory = rows[0]
 
     # 同步更新到 MemoryManager
-    memory = dict(execute_query('SELECT * FROM memories WHERE id = ?', (memory_id,))[0])
     if memory.get('mem0_memory_id'):
         # Mem0 update (primarily updates content)
         # Note: If title changed, we might want to update it in metadata if mem0 supports it, 
         # but mem0.update mainly takes 'text'.
         # We'll use the new content (or existing content if not changed).
         current_content = memory['content']
-        agent_service.update_memory(memory['mem0_memory_id'], current_content)
+        submit_background(agent_service.update_memory, memory['mem0_memory_id'], current_content)
 
+    _invalidate_memory_list(request.current_user_id)
     return success_response(memory, '记忆更新成功')
 
 @memories_bp.route('/<int:memory_id>', methods=['DELETE'])
 @require_auth
 def delete_memory(memory_id):
     """删除记忆"""
-    if not verify_resource_ownership('memories', memory_id, request.current_user_id):
+    # 归属校验与删除合并为一条语句，同时取回 mem0_memory_id
+    deleted = execute_returning(
+        'DELETE FROM memories WHERE id = ? AND user_id = ? RETURNING mem0_memory_id',
+        (memory_id, request.current_user_id)
+    )
+    if not deleted:
         return error_response('记忆不存在或无权限', 'NOT_FOUND', 404)
-    
-    # Get mem0_memory_id before deletion
-    memory = execute_query('SELECT mem0_memory_id FROM memories WHERE id = ?', (memory_id,))
-    mem0_id = memory[0]['mem0_memory_id'] if memory else None
-
-    execute_update('DELETE FROM memories WHERE id = ? AND user_id = ?', (memory_id, request.current_user_id))
+    mem0_id = deleted[0]['mem0_memory_id']
     
     if mem0_id:
-        agent_service.delete_memory(mem0_id)
+        submit_background(agent_service.delete_memory, mem0_id)
 
+    _invalidate_memory_list(request.current_user_id)
     return success_response(None, '记忆删除成功')
 
 @memories_bp.route('/search', methods=['POST'])
 @require_auth
 def search_memories():
     """语义搜索记忆（必须指定对话ID）"""
-    data = request.get_json()
-    if not data or not data.get('query'):
-        return error_response('缺少必需字段：query', 'VALIDATION_ERROR', 400)
+    data, error = parse_body(SearchMemoriesRequest)
+    if error:
+        return error_response(error, 'VALIDATION_ERROR', 400)
     
-    conversation_id = data.get('conversation_id')
-    if not conversation_id:
-        return error_response('缺少必需字段：conversation_id', 'VALIDATION_ERROR', 400)
+    conversation_id = data['conversation_id']
     
     # 验证用户有权限访问该对话
     try:
@@ -1,15 +1,25 @@
-from flask import Blueprint, request, current_app
+from flask import Blueprint, request
 import logging
 import sqlite3
-from ..core.db import execute_query, execute_update
+from typing import TypedDict, Union
+from ..core.db import execute_query, execute_update, execute_transaction, transaction
 from ..core.auth_utils import require_auth
-from ..core.utils import success_response, error_response, encrypt_api_key, decrypt_api_key, verify_resource_ownership
-from ..services.agent_service import agent_service
+from ..core.config import SETTINGS
+from ..core.utils import success_response, error_response, encrypt_api_key, decrypt_api_key, verify_resource_ownership, submit_background, parse_body
+from ..services.agent_service import agent_service, shared_http_client
 
 logger = logging.getLogger(__name__)
 
 models_bp = Blueprint('models', __name__, url_prefix='/api/user/model-configs')
 
+# 创建与更新共用；缺失字段的提示由处理函数给出
+class ModelConfigRequest(TypedDict, total=False):
+    provider: str
+    model_name: str
+    api_key: str
+    base_url: str
+    is_default: Union[bool, int]
+
 # 模型提供商配置
 MODEL_PROVIDERS = {
     'deepseek': {
@@ -35,6 +45,26 @@ MODEL_PROVIDERS = {
     }
 }
 
+# 测试连接的请求超时
+_TEST_CLIENT_TIMEOUT = 10.0  # 秒
+
+def _get_test_client(base_url: str, api_key: str):
+    """每次测试新建轻量 OpenAI 客户端，连接复用由共享的 httpx 连接池提供，不长期持有带 API Key 的客户端"""
+    from openai import OpenAI
+    return OpenAI(api_key=api_key, base_url=base_url, timeout=_TEST_CLIENT_TIMEOUT, http_client=shared_http_client)
+
+# 单条语句切换默认配置：目标行置 1，该用户其余默认行置 0
+_SET_DEFAULT_SQL = '''UPDATE user_model_configs
+    SET is_default = CASE WHEN id = ? THEN 1 ELSE 0 END,
+        updated_at = CASE WHEN id = ? THEN CURRENT_TIMESTAMP ELSE updated_at END
+    WHERE user_id = ? AND (is_default = 1 OR id = ?)'''
+
+def _set_default_params(config_id: int, user_id: int) -> tuple:
+    return (config_id, config_id, user_id, config_id)
+
+# 各提供商支持的模型集合（空集合表示不限制模型名称），校验时 O(1) 查找
+_PROVIDER_MODELS = {name: frozenset(p['models']) for name, p in MODEL_PROVIDERS.items()}
+
 @models_bp.route('/providers', methods=['GET'])
 @require_auth
 def get_model_providers():
@@ -52,7 +82,7 @@ def get_model_configs():
         (request.current_user_id,)
     )
     return success_response({
-        'configs': [dict(c) for c in configs]
+        'configs': configs
     })
 
 @models_bp.route('/default', methods=['GET'])
@@ -64,41 +94,44 @@ def get_default_model_config():
         (request.current_user_id,)
     )
     if config:
-        return success_response(dict(config[0]))
+        return success_response(config[0])
     return error_response('未设置默认模型配置', 'NOT_FOUND', 404)
 
 @models_bp.route('', methods=['POST'])
 @require_auth
 def create_model_config():
     """创建新的模型配置"""
-    data = request.get_json()
-    if not data:
-        return error_response('缺少请求数据', 'VALIDATION_ERROR', 400)
+    data, error = parse_body(ModelConfigRequest)
+    if error:
+        return error_response(error, 'VALIDATION_ERROR', 400)
     
-    provider = data.get('provider', '').strip().lower()
-    model_name = data.get('model_name', '').strip()
-    api_key = data.get('api_key', '').strip()
-    base_url = data.get('base_url', '').strip()
+    provider = (data.get('provider') or '').strip().lower()
+    model_name = (data.get('model_name') or '').strip()
+    api_key = (data.get('api_key') or '').strip()
+    base_url = (data.get('base_url') or '').strip()
     is_default = data.get('is_default', False)
     
     # 验证
-    available_models = MODEL_PROVIDERS[provider].get('models', [])
-    if provider in MODEL_PROVIDERS and available_models and model_name not in available_models:
-        return error_response(f'不支持的模型名称，支持的模型: {", ".join(available_models)}', 'VALIDATION_ERROR', 400)
+    provider_info = MODEL_PROVIDERS.get(provider)
+    if provider_info is None:
+        return error_response('不支持的模型提供商', 'VALIDATION_ERROR', 400)
+    available_models = _PROVIDER_MODELS[provider]
+    if available_models and model_name not in available_models:
+        return error_response(f'不支持的模型名称，支持的模型: {", ".join(provider_info["models"])}', 'VALIDATION_ERROR', 400)
     if not model_name:
         return error_response('模型名称不能为空', 'VALIDATION_ERROR', 400)
-    if len(model_name) > current_app.config['MAX_MODEL_NAME_LENGTH']:
-        return error_response(f'模型名称长度不能超过{current_app.config["MAX_MODEL_NAME_LENGTH"]}个字符', 'VALIDATION_ERROR', 400)
+    if len(model_name) > SETTINGS.max_model_name_length:
+        return error_response(SETTINGS.err_model_name_length, 'VALIDATION_ERROR', 400)
     if not api_key:
         return error_response('API Key 不能为空', 'VALIDATION_ERROR', 400)
-    if len(api_key) > current_app.config['MAX_API_KEY_LENGTH']:
-        return error_response(f'API Key 长度不能超过{current_app.config["MAX_API_KEY_LENGTH"]}个字符', 'VALIDATION_ERROR', 400)
-    if base_url and len(base_url) > current_app.config['MAX_BASE_URL_LENGTH']:
-        return error_response(f'Base URL 长度不能超过{current_app.config["MAX_BASE_URL_LENGTH"]}个字符', 'VALIDATION_ERROR', 400)
+    if len(api_key) > SETTINGS.max_api_key_length:
+        return error_response(SETTINGS.err_api_key_length, 'VALIDATION_ERROR', 400)
+    if base_url and len(base_url) > SETTINGS.max_base_url_length:
+        return error_response(SETTINGS.err_base_url_length, 'VALIDATION_ERROR', 400)
     
     # 使用默认 base_url 如果未提供
     if not base_url:
-        base_url = MODEL_PROVIDERS[provider]['base_url']
+        base_url = provider_info['base_url']
     
     # 加密 API Key
     try:
@@ -107,25 +140,19 @@ def create_model_config():
         logger.error(f'加密 API Key 失败: {str(e)}')
         return error_response('API Key 加密失败', 'INTERNAL_ERROR', 500)
     
-    # 如果设置为默认，先取消其他默认配置
-    if is_default:
-        execute_update(
-            'UPDATE user_model_configs SET is_default = 0 WHERE user_id = ?',
-            (request.current_user_id,)
-        )
-    
     try:
-        # 保存配置...
-        config_id = execute_update(
-            'INSERT INTO user_model_configs (user_id, provider, model_name, api_key, base_url, is_default) VALUES (?, ?, ?, ?, ?, ?)',
-            (request.current_user_id, provider, model_name, encrypted_api_key, base_url, 1 if is_default else 0)
-        )
+        # 保存配置；设为默认时在同一事务内取消其他默认配置
+        with transaction() as conn:
+            config_id = conn.execute(
+                'INSERT INTO user_model_configs (user_id, provider, model_name, api_key, base_url, is_default) VALUES (?, ?, ?, ?, ?, 0) RETURNING id',
+                (request.current_user_id, provider, model_name, encrypted_api_key, base_url)
+            ).fetchone()[0]
+            if is_default:
+                conn.execute(_SET_DEFAULT_SQL, _set_default_params(config_id, request.current_user_id))
         
-        # === [新增] 配置变更后预热 ===
-        try:
-            agent_service.warm_up_for_user(request.current_user_id)
-        except: pass
-        # ===========================
+        # 配置变更后丢弃缓存的模型配置，并在后台预热，不阻塞响应
+        agent_service.invalidate_user_llm(request.current_user_id)
+        submit_background(agent_service.warm_up_for_user, request.current_user_id)
         return success_response({'id': config_id}, '模型配置创建成功')
     except sqlite3.IntegrityError:
         return error_response('该模型配置已存在', 'DUPLICATE_ERROR', 409)
@@ -140,9 +167,9 @@ def update_model_config(config_id):
     if not verify_resource_ownership('user_model_configs', config_id, request.current_user_id):
         return error_response('模型配置不存在或无权限', 'NOT_FOUND', 404)
     
-    data = request.get_json()
-    if not data:
-        return error_response('缺少请求数据', 'VALIDATION_ERROR', 400)
+    data, error = parse_body(ModelConfigRequest)
+    if error:
+        return error_response(error, 'VALIDATION_ERROR', 400)
     
     provider = data.get('provider', '').strip().lower() if data.get('provider') else None
     model_name = data.get('model_name', '').strip() if data.get('model_name') else None
@@ -158,23 +185,24 @@ def update_model_config(config_id):
     if not existing:
         return error_response('模型配置不存在', 'NOT_FOUND', 404)
     
-    existing = dict(existing[0])
+    existing = existing[0]
     provider = provider or existing['provider']
     model_name = model_name or existing['model_name']
-    base_url = base_url or existing['base_url'] or MODEL_PROVIDERS[provider]['base_url']
     
     # 验证
-    if provider not in MODEL_PROVIDERS:
+    provider_info = MODEL_PROVIDERS.get(provider)
+    if provider_info is None:
         return error_response('不支持的模型提供商', 'VALIDATION_ERROR', 400)
-    if model_name and len(model_name) > current_app.config['MAX_MODEL_NAME_LENGTH']:
-        return error_response(f'模型名称长度不能超过{current_app.config["MAX_MODEL_NAME_LENGTH"]}个字符', 'VALIDATION_ERROR', 400)
-    available_models = MODEL_PROVIDERS[provider].get('models', [])
+    base_url = base_url or existing['base_url'] or provider_info['base_url']
+    if model_name and len(model_name) > SETTINGS.max_model_name_length:
+        return error_response(SETTINGS.err_model_name_length, 'VALIDATION_ERROR', 400)
+    available_models = _PROVIDER_MODELS[provider]
     if available_models and model_name not in available_models:
         return error_response('不支持的模型名称', 'VALIDATION_ERROR', 400)
-    if api_key and len(api_key) > current_app.config['MAX_API_KEY_LENGTH']:
-        return error_response(f'API Key 长度不能超过{current_app.config["MAX_API_KEY_LENGTH"]}个字符', 'VALIDATION_ERROR', 400)
-    if base_url and len(base_url) > current_app.config['MAX_BASE_URL_LENGTH']:
-        return error_response(f'Base URL 长度不能超过{current_app.config["MAX_BASE_URL_LENGTH"]}个字符', 'VALIDATION_ERROR', 400)
+    if api_key and len(api_key) > SETTINGS.max_api_key_length:
+        return error_response(SETTINGS.err_api_key_length, 'VALIDATION_ERROR', 400)
+    if base_url and len(base_url) > SETTINGS.max_base_url_length:
+        return error_response(SETTINGS.err_base_url_length, 'VALIDATION_ERROR', 400)
     
     # 如果设置了新的 API Key，加密它
     encrypted_api_key = None
@@ -185,46 +213,38 @@ def update_model_config(config_id):
             logger.error(f'加密 API Key 失败: {str(e)}')
             return error_response('API Key 加密失败', 'INTERNAL_ERROR', 500)
     
-    # 如果设置为默认，先取消其他默认配置
-    if is_default:
-        execute_update(
-            'UPDATE user_model_configs SET is_default = 0 WHERE user_id = ? AND id != ?',
-            (request.current_user_id, config_id)
-        )
     update_fields = []
     update_params = []
     if encrypted_api_key:
         update_fields.append('api_key = ?')
         update_params.append(encrypted_api_key)
-    if provider and provider in MODEL_PROVIDERS:
+    if provider:
         update_fields.append('provider = ?')
         update_params.append(provider)
-    if model_name and model_name in MODEL_PROVIDERS[provider]['models']:
+    if model_name:
         update_fields.append('model_name = ?')
         update_params.append(model_name)
     if base_url:
         update_fields.append('base_url = ?')
         update_params.append(base_url)
-    if is_default is not None:
-        update_fields.append('is_default = ?')
-        update_params.append(1 if is_default else 0)
+    if is_default is not None and not is_default:
+        update_fields.append('is_default = 0')
     
-    if not update_fields:
+    if not update_fields and not is_default:
         return error_response('没有需要更新的字段', 'VALIDATION_ERROR', 400)
     
     update_fields.append('updated_at = CURRENT_TIMESTAMP')
     update_params.append(config_id)
+    statements = [(f'UPDATE user_model_configs SET {", ".join(update_fields)} WHERE id = ?', tuple(update_params))]
+    # 设为默认：以单条 CASE 语句同时设置本配置并取消其他默认配置
+    if is_default:
+        statements.append((_SET_DEFAULT_SQL, _set_default_params(config_id, request.current_user_id)))
     
     try:
-        execute_update(
-            f'UPDATE user_model_configs SET {", ".join(update_fields)} WHERE id = ?',
-            tuple(update_params)
-        )
-        # === [新增] 配置变更后预热 ===
-        try:
-            agent_service.warm_up_for_user(request.current_user_id)
-        except: pass
-        # ===========================
+        execute_transaction(statements)
+        # 配置变更后丢弃缓存的模型配置，并在后台预热，不阻塞响应
+        agent_service.invalidate_user_llm(request.current_user_id)
+        submit_background(agent_service.warm_up_for_user, request.current_user_id)
         logger.info(f'更新模型配置成功: config_id={config_id}')
         return success_response(None, '模型配置更新成功')
     except Exception as e:
@@ -240,6 +260,7 @@ def delete_model_config(config_id):
     
     try:
         execute_update('DELETE FROM user_model_configs WHERE id = ?', (config_id,))
+        agent_service.invalidate_user_llm(request.current_user_id)
         logger.info(f'删除模型配置成功: config_id={config_id}')
         return success_response(None, '模型配置删除成功')
     except Exception as e:
@@ -254,16 +275,8 @@ def set_default_model_config(config_id):
         return error_response('模型配置不存在或无权限', 'NOT_FOUND', 404)
     
     try:
-        # 先取消所有默认配置
-        execute_update(
-            'UPDATE user_model_configs SET is_default = 0 WHERE user_id = ?',
-            (request.current_user_id,)
-        )
-        # 设置新的默认配置
-        execute_update(
-            'UPDATE user_model_configs SET is_default = 1, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
-            (config_id,)
-        )
+        execute_update(_SET_DEFAULT_SQL, _set_default_params(config_id, request.current_user_id))
+        agent_service.invalidate_user_llm(request.current_user_id)
         logger.info(f'设置默认模型配置成功: config_id={config_id}')
         return success_response(None, '默认模型配置设置成功')
     except Exception as e:
@@ -284,7 +297,7 @@ def test_model_config(config_id):
     if not config:
         return error_response('模型配置不存在', 'NOT_FOUND', 404)
     
-    config = dict(config[0])
+    config = config[0]
     try:
         api_key = decrypt_api_key(config['api_key'])
     except Exception as e:
@@ -293,11 +306,7 @@ def test_model_config(config_id):
     
     # 测试 API Key
     try:
-        from openai import OpenAI
-        client = OpenAI(
-            api_key=api_key,
-            base_url=config['base_url']
-        )
+        client = _get_test_client(config['base_url'], api_key)
         # 发送一个简单的测试请求
         response = client.chat.completions.create(
             model=config['model_name'],
@@ -1,37 +1,159 @@
 from functools import wraps
-from datetime import datetime
-from typing import Optional, Dict
+from datetime import datetime, timezone
+from collections import OrderedDict
+from typing import Optional, Dict, Tuple
+import base64
+import hashlib
+import threading
+import time
+import bcrypt
 import jwt
 from flask import request, jsonify, current_app
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import check_password_hash
+from .config import SETTINGS
+from .db import execute_query
+
+_BCRYPT_PREFIXES = ('$2a$', '$2b$', '$2y$')
+_dummy_password_hash: Optional[str] = None
+
+def _prehash_password(password: str) -> bytes:
+    """SHA-256 预哈希后 base64 编码，规避 bcrypt 的 72 字节截断和空字节问题"""
+    return base64.b64encode(hashlib.sha256(password.encode()).digest())
 
 def hash_password(password: str) -> str:
-    """使用werkzeug生成密码哈希"""
-    return generate_password_hash(password)
+    """使用 bcrypt 生成密码哈希，成本因子由 BCRYPT_COST 配置"""
+    salt = bcrypt.gensalt(current_app.config['BCRYPT_COST'])
+    return bcrypt.hashpw(_prehash_password(password), salt).decode()
 
 def check_password(password: str, password_hash: str) -> bool:
-    """验证密码"""
+    """验证密码（兼容早期 werkzeug 生成的哈希）"""
+    if password_hash.startswith(_BCRYPT_PREFIXES):
+        return bcrypt.checkpw(_prehash_password(password), password_hash.encode())
     return check_password_hash(password_hash, password)
 
-def generate_token(user_id: int) -> str:
-    """生成JWT token"""
+def password_needs_rehash(password_hash: str) -> bool:
+    """哈希为旧格式或成本因子低于当前配置时需要重新哈希"""
+    if not password_hash.startswith(_BCRYPT_PREFIXES):
+        return True
+    try:
+        cost = int(password_hash.split('$')[2])
+    except (IndexError, ValueError):
+        return True
+    return cost < current_app.config['BCRYPT_COST']
+
+def check_dummy_password(password: str) -> None:
+    """用户不存在时对固定哈希做一次校验，使登录耗时与用户是否存在无关"""
+    global _dummy_password_hash
+    if _dummy_password_hash is None:
+        _dummy_password_hash = hash_password('dummy-password-for-timing')
+    check_password(password, _dummy_password_hash)
+
+# 已签发 token 缓存：有效期内重复登录/刷新直接复用，免去重新签名
+_ISSUED_TOKEN_CACHE_MAXSIZE = 10000
+_ISSUED_TOKEN_MIN_REMAINING = 30  # 剩余有效期不足该秒数时重新签发
+_issued_tokens: 'OrderedDict[int, Tuple[str, float, int]]' = OrderedDict()
+_issued_tokens_lock = threading.Lock()
+
+def get_token_version(user_id: int) -> int:
+    """读取用户当前的 token 版本号（修改密码时递增以吊销旧 token）"""
+    result = execute_query('SELECT token_version FROM users WHERE id = ?', (user_id,))
+    return (result[0]['token_version'] or 0) if result else -1
+
+def generate_token(user_id: int, token_version: Optional[int] = None, reuse: bool = True) -> Tuple[str, int]:
+    """生成JWT token，返回 (token, 剩余有效秒数)；reuse 为 True 时有效期内复用已签发的 token"""
+    if token_version is None:
+        token_version = get_token_version(user_id)
+    now = time.time()
+    with _issued_tokens_lock:
+        entry = _issued_tokens.get(user_id)
+        if entry is not None:
+            token, exp_ts, version = entry
+            if reuse and version == token_version and exp_ts - now > _ISSUED_TOKEN_MIN_REMAINING:
+                _issued_tokens.move_to_end(user_id)
+                return token, int(exp_ts - now)
+            del _issued_tokens[user_id]
+
+    issued_at = datetime.utcnow()
+    expires_at = issued_at + SETTINGS.jwt_expiration_delta
     payload = {
         'user_id': user_id,
-        'exp': datetime.utcnow() + current_app.config['JWT_EXPIRATION_DELTA'],
-        'iat': datetime.utcnow()
+        'ver': token_version,
+        'exp': expires_at,
+        'iat': issued_at
     }
-    return jwt.encode(payload, current_app.config['SECRET_KEY'], algorithm=current_app.config['JWT_ALGORITHM'])
+    token = jwt.encode(payload, SETTINGS.jwt_secret_key, algorithm=SETTINGS.jwt_algorithm)
+    with _issued_tokens_lock:
+        _issued_tokens[user_id] = (token, expires_at.replace(tzinfo=timezone.utc).timestamp(), token_version)
+        while len(_issued_tokens) > _ISSUED_TOKEN_CACHE_MAXSIZE:
+            _issued_tokens.popitem(last=False)
+    return token, SETTINGS.jwt_expires_in
+
+def revoke_user_tokens(user_id: int) -> None:
+    """丢弃该用户在本进程内缓存的已签发/已验证 token
+
+    其他 worker 进程的验证缓存不受影响，旧 token 在那里最多还会被接受 _TOKEN_CACHE_TTL 秒
+    """
+    with _issued_tokens_lock:
+        _issued_tokens.pop(user_id, None)
+    with _token_cache_lock:
+        for key in [k for k, v in _token_cache.items() if v[0] == user_id]:
+            del _token_cache[key]
+
+# 缺少 exp / user_id 的 token 直接拒绝
+_JWT_DECODE_OPTIONS = {'require': ['exp', 'user_id']}
 
 def verify_token(token: str) -> Optional[Dict]:
     """验证JWT token"""
+    # 签名比较由 PyJWT (>=2.0) 内部以 hmac.compare_digest 常量时间完成，勿在此处自行用 == 比较签名
     try:
-        payload = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=[current_app.config['JWT_ALGORITHM']])
+        payload = jwt.decode(token, SETTINGS.jwt_secret_key, algorithms=SETTINGS.jwt_algorithms, options=_JWT_DECODE_OPTIONS)
         return payload
     except jwt.ExpiredSignatureError:
         return None
     except jwt.InvalidTokenError:
         return None
 
+# Token 验证缓存：同一会话的连续请求无需重复 HMAC 校验
+_TOKEN_CACHE_MAXSIZE = 4096
+# 版本号只在缓存未命中时核对，TTL 即吊销（修改密码）在其他 worker 上生效的最大延迟
+_TOKEN_CACHE_TTL = 10  # 秒
+_TOKEN_EXP_LEEWAY = 5  # 距离过期不足该秒数时重新完整校验
+_token_cache: 'OrderedDict[bytes, Tuple[int, float, float]]' = OrderedDict()
+_token_cache_lock = threading.Lock()
+
+def _token_cache_key(token: str) -> bytes:
+    """以摘要作为缓存键，避免在内存中保存原始 token"""
+    return hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+def verify_token_cached(token: str) -> Optional[Tuple[int, float]]:
+    """带 TTL-LRU 缓存的 token 验证，返回 (user_id, exp_ts)"""
+    key = _token_cache_key(token)
+    now = time.time()
+    with _token_cache_lock:
+        entry = _token_cache.get(key)
+        if entry is not None:
+            user_id, exp_ts, cached_at = entry
+            if now < exp_ts - _TOKEN_EXP_LEEWAY and now - cached_at < _TOKEN_CACHE_TTL:
+                _token_cache.move_to_end(key)
+                return user_id, exp_ts
+            del _token_cache[key]
+
+    payload = verify_token(token)
+    if not payload:
+        return None
+
+    user_id = payload['user_id']
+    # 仅在缓存未命中时核对 token 版本，已吊销的 token 不再通过
+    if payload.get('ver', 0) != get_token_version(user_id):
+        return None
+    exp_ts = float(payload.get('exp', now))
+    with _token_cache_lock:
+        _token_cache[key] = (user_id, exp_ts, now)
+        _token_cache.move_to_end(key)
+        while len(_token_cache) > _TOKEN_CACHE_MAXSIZE:
+            _token_cache.popitem(last=False)
+    return user_id, exp_ts
+
 def require_auth(f):
     """认证装饰器"""
     @wraps(f)
@@ -51,15 +173,15 @@ def require_auth(f):
                 'error_code': 'UNAUTHORIZED'
             }), 401
         
-        payload = verify_token(token)
-        if not payload:
+        verified = verify_token_cached(token)
+        if not verified:
             return jsonify({
                 'success': False,
                 'message': 'Token无效或已过期',
                 'error_code': 'TOKEN_INVALID'
             }), 401
         
-        request.current_user_id = payload['user_id']
+        request.current_user_id, _ = verified
         return f(*args, **kwargs)
     
     return decorated
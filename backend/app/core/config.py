@@ -1,6 +1,8 @@
 import os
 import logging
+from dataclasses import dataclass, field
 from datetime import timedelta
+from typing import Mapping
 
 class Config:
     # Basic Config
@@ -12,8 +14,11 @@ class Config:
     
     JWT_ALGORITHM = 'HS256'
     JWT_EXPIRATION_DELTA = timedelta(hours=24)
+    BCRYPT_COST = int(os.environ.get('BCRYPT_COST', 12))
     DATABASE = os.environ.get('DATABASE', 'app.db')
     AGENT_SERVICE_URL = os.environ.get('AGENT_SERVICE_URL', '')
+    # 工具调用线程池大小（I/O 密集：向量库 / 图数据库 / LLM 请求）
+    AGENT_TOOL_WORKERS = int(os.environ.get('AGENT_TOOL_WORKERS', (os.cpu_count() or 1) * 5))
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB
 
     # CORS
@@ -36,3 +41,61 @@ class Config:
             level=logging.INFO,
             format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
         )
+
+@dataclass
+class Settings:
+    """create_app 时从 app.config 快照的常量，避免每个请求查 config 字典"""
+    max_username_length: int = Config.MAX_USERNAME_LENGTH
+    max_email_length: int = Config.MAX_EMAIL_LENGTH
+    max_message_length: int = Config.MAX_MESSAGE_LENGTH
+    max_memory_title_length: int = Config.MAX_MEMORY_TITLE_LENGTH
+    max_memory_content_length: int = Config.MAX_MEMORY_CONTENT_LENGTH
+    max_model_name_length: int = Config.MAX_MODEL_NAME_LENGTH
+    max_api_key_length: int = Config.MAX_API_KEY_LENGTH
+    max_base_url_length: int = Config.MAX_BASE_URL_LENGTH
+    jwt_expires_in: int = int(Config.JWT_EXPIRATION_DELTA.total_seconds())
+    jwt_expiration_delta: timedelta = Config.JWT_EXPIRATION_DELTA
+    jwt_secret_key: str = Config.SECRET_KEY
+    jwt_algorithm: str = Config.JWT_ALGORITHM
+    jwt_algorithms: list = field(default_factory=lambda: [Config.JWT_ALGORITHM])
+    # 预先格式化的校验错误信息
+    err_username_length: str = ''
+    err_email_length: str = ''
+    err_message_length: str = ''
+    err_memory_title_length: str = ''
+    err_memory_content_length: str = ''
+    err_model_name_length: str = ''
+    err_api_key_length: str = ''
+    err_base_url_length: str = ''
+
+    def __post_init__(self):
+        self._format_messages()
+
+    def _format_messages(self):
+        self.err_username_length = f'用户名长度必须在3-{self.max_username_length}个字符之间'
+        self.err_email_length = f'邮箱长度不能超过{self.max_email_length}个字符'
+        self.err_message_length = f'消息内容长度不能超过{self.max_message_length}个字符'
+        self.err_memory_title_length = f'记忆标题长度不能超过{self.max_memory_title_length}个字符'
+        self.err_memory_content_length = f'记忆内容长度不能超过{self.max_memory_content_length}个字符'
+        self.err_model_name_length = f'模型名称长度不能超过{self.max_model_name_length}个字符'
+        self.err_api_key_length = f'API Key 长度不能超过{self.max_api_key_length}个字符'
+        self.err_base_url_length = f'Base URL 长度不能超过{self.max_base_url_length}个字符'
+
+    def load(self, config: Mapping):
+        """从 app.config 重新载入（在 create_app 中调用一次）"""
+        self.max_username_length = config['MAX_USERNAME_LENGTH']
+        self.max_email_length = config['MAX_EMAIL_LENGTH']
+        self.max_message_length = config['MAX_MESSAGE_LENGTH']
+        self.max_memory_title_length = config['MAX_MEMORY_TITLE_LENGTH']
+        self.max_memory_content_length = config['MAX_MEMORY_CONTENT_LENGTH']
+        self.max_model_name_length = config['MAX_MODEL_NAME_LENGTH']
+        self.max_api_key_length = config['MAX_API_KEY_LENGTH']
+        self.max_base_url_length = config['MAX_BASE_URL_LENGTH']
+        self.jwt_expires_in = int(config['JWT_EXPIRATION_DELTA'].total_seconds())
+        self.jwt_expiration_delta = config['JWT_EXPIRATION_DELTA']
+        self.jwt_secret_key = config['SECRET_KEY']
+        self.jwt_algorithm = config['JWT_ALGORITHM']
+        self.jwt_algorithms = [config['JWT_ALGORITHM']]
+        self._format_messages()
+
+SETTINGS = Settings()
@@ -1,21 +1,131 @@
 import sqlite3
 import logging
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
 from datetime import datetime, timezone
-from typing import List
-from flask import current_app
+from typing import Dict, Iterable, List, Tuple
+from flask import current_app, g
 
 logger = logging.getLogger(__name__)
 
+# 已完成建表的数据库路径，重复创建 app（如测试夹具）时跳过
+_initialized_db_paths = set()
+
+# 每个连接的预编译语句缓存容量（sqlite3 按 SQL 文本复用已编译语句，默认 128）
+_STATEMENT_CACHE_SIZE = 256
+
+# 当前 schema 版本，记录在 PRAGMA user_version 中；新增迁移时递增
+_SCHEMA_VERSION = 2
+
+# 每个连接建立后执行一次的 PRAGMA
+_CONNECTION_PRAGMAS = (
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA mmap_size=268435456',
+    'PRAGMA cache_size=-65536',  # 64MB 页缓存
+)
+
 def get_db_path():
     return current_app.config['DATABASE']
 
+# 连接池：db_path -> 空闲连接。Werkzeug 多线程服务器为每个请求新建线程，线程本地连接无法复用；
+# 连接改为按应用上下文借出、上下文结束时归还，跨请求保持页缓存与语句缓存的热状态
+_POOL_MAXSIZE = 8  # 每个数据库保留的空闲连接数
+_pools: Dict[str, List[sqlite3.Connection]] = {}
+_pool_lock = threading.Lock()
+
+def _connect(db_path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(
+        db_path,
+        isolation_level=None,
+        check_same_thread=False,
+        cached_statements=_STATEMENT_CACHE_SIZE
+    )
+    conn.row_factory = sqlite3.Row
+    for pragma in _CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+def get_conn() -> sqlite3.Connection:
+    """获取当前应用上下文借用的数据库连接（自动提交模式），上下文内首次调用时从连接池取出"""
+    conns = g.setdefault('_db_conns', {})
+    db_path = get_db_path()
+    conn = conns.get(db_path)
+    if conn is None:
+        with _pool_lock:
+            idle = _pools.get(db_path)
+            conn = idle.pop() if idle else None
+        if conn is None:
+            conn = _connect(db_path)
+        conns[db_path] = conn
+    return conn
+
+def close_conn(exception=None):
+    """应用上下文结束时归还连接：回滚残留的未提交事务后放回连接池，池满时关闭"""
+    conns = g.pop('_db_conns', None)
+    if not conns:
+        return
+    for db_path, conn in conns.items():
+        if conn.in_transaction:
+            conn.rollback()
+        with _pool_lock:
+            idle = _pools.setdefault(db_path, [])
+            if len(idle) < _POOL_MAXSIZE:
+                idle.append(conn)
+                continue
+        conn.close()
+
+def close_idle_conns():
+    """关闭连接池中的所有空闲连接（测试清理或进程退出时调用）"""
+    with _pool_lock:
+        conns = [conn for idle in _pools.values() for conn in idle]
+        _pools.clear()
+    for conn in conns:
+        conn.close()
+
+def _migrate(c: sqlite3.Cursor) -> bool:
+    """对旧库补齐后续新增的列，全部成功时返回 True"""
+    ok = True
+    # 数据库迁移：为memories表添加conversation_id字段
+    try:
+        # 检查memories表是否已有conversation_id字段
+        c.execute("PRAGMA table_info(memories)")
+        columns = c.fetchall()
+        column_names = [col[1] for col in columns]
+
+        if 'conversation_id' not in column_names:
+            logger.info('为memories表添加conversation_id字段')
+            c.execute('ALTER TABLE memories ADD COLUMN conversation_id INTEGER REFERENCES conversations(id) ON DELETE CASCADE')
+    except Exception as e:
+        logger.error(f'数据库迁移失败: {str(e)}')
+        ok = False
+        # 不抛出异常，继续运行
+
+    # 数据库迁移：为users表添加token_version字段
+    try:
+        c.execute("PRAGMA table_info(users)")
+        column_names = [col[1] for col in c.fetchall()]
+        if 'token_version' not in column_names:
+            logger.info('为users表添加token_version字段')
+            c.execute('ALTER TABLE users ADD COLUMN token_version INTEGER DEFAULT 0')
+    except Exception as e:
+        logger.error(f'数据库迁移失败: {str(e)}')
+        ok = False
+    return ok
+
 def init_db(app=None):
     """初始化数据库表"""
     # If app is provided, use its config, otherwise use current_app
     db_path = app.config['DATABASE'] if app else get_db_path()
+    if db_path in _initialized_db_paths:
+        return
     
     conn = sqlite3.connect(db_path)
     c = conn.cursor()
+    # WAL 为持久化设置，建库时开启一次即可：读写互不阻塞（内存数据库不支持 WAL）
+    if db_path != ':memory:':
+        c.execute('PRAGMA journal_mode=WAL')
     
     # 用户表
     c.execute('''
@@ -24,6 +134,7 @@ def init_db(app=None):
             username TEXT UNIQUE NOT NULL,
             email TEXT UNIQUE NOT NULL,
             password_hash TEXT NOT NULL,
+            token_version INTEGER DEFAULT 0,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
@@ -92,27 +203,37 @@ def init_db(app=None):
         )
     ''')
     
-    # 数据库迁移：为memories表添加conversation_id字段
-    try:
-        # 检查memories表是否已有conversation_id字段
-        c.execute("PRAGMA table_info(memories)")
-        columns = c.fetchall()
-        column_names = [col[1] for col in columns]
-
-        if 'conversation_id' not in column_names:
-            logger.info('为memories表添加conversation_id字段')
-            c.execute('ALTER TABLE memories ADD COLUMN conversation_id INTEGER REFERENCES conversations(id) ON DELETE CASCADE')
-    except Exception as e:
-        logger.error(f'数据库迁移失败: {str(e)}')
-        # 不抛出异常，继续运行
+    # 列表分页索引
+    c.execute('CREATE INDEX IF NOT EXISTS idx_conv_user_upd ON conversations(user_id, updated_at DESC)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_msg_conv_created ON messages(conversation_id, created_at)')
+    # 模型配置列表 / 默认配置查询、按用户与对话筛选记忆
+    c.execute('CREATE INDEX IF NOT EXISTS idx_umc_user_default ON user_model_configs(user_id, is_default DESC, created_at DESC)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_memories_user_conv ON memories(user_id, conversation_id)')
+    
+    # 数据库迁移：已记录的 schema 版本 (PRAGMA user_version) 达到当前版本时跳过列检查
+    if c.execute('PRAGMA user_version').fetchone()[0] < _SCHEMA_VERSION:
+        if _migrate(c):
+            c.execute(f'PRAGMA user_version = {_SCHEMA_VERSION}')
 
     conn.commit()
+    # 刷新查询规划器统计信息，使索引被选用：首次（尚无 sqlite_stat1）完整 ANALYZE，之后只对需要的表执行
+    has_stats = c.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone()
+    c.execute('PRAGMA optimize' if has_stats else 'ANALYZE')
     conn.close()
+    _initialized_db_paths.add(db_path)
 
 def convert_timestamp_to_iso(timestamp_str: str) -> str:
     """将 SQLite 时间戳转换为 ISO 8601 格式（UTC）"""
     if not timestamp_str:
         return timestamp_str
+    return _iso_from_sqlite_ts(timestamp_str)
+
+# 同一对话/列表的时间戳大量重复，缓存解析结果（有界，避免无限增长）
+@lru_cache(maxsize=4096)
+def _iso_from_sqlite_ts(timestamp_str: str) -> str:
+    # 快速路径：固定 19 位 'YYYY-MM-DD HH:MM:SS'，直接拼接为 'YYYY-MM-DDTHH:MM:SSZ'
+    if isinstance(timestamp_str, str) and len(timestamp_str) == 19 and timestamp_str[4] == '-' and timestamp_str[10] == ' ':
+        return f'{timestamp_str[:10]}T{timestamp_str[11:]}Z'
     try:
         # SQLite 的 CURRENT_TIMESTAMP 返回格式: 'YYYY-MM-DD HH:MM:SS' (UTC)
         # 转换为 ISO 8601 格式并添加 UTC 时区标识
@@ -125,57 +246,93 @@ def convert_timestamp_to_iso(timestamp_str: str) -> str:
         # 如果解析失败，返回原值
         return timestamp_str
 
-def execute_query(query: str, params: tuple = ()) -> List[sqlite3.Row]:
+# 需要转换为 ISO 8601 的时间戳列
+_TIMESTAMP_FIELDS = frozenset(('created_at', 'updated_at', 'last_message_at', 'edited_at'))
+
+def _convert_rows(cursor: sqlite3.Cursor) -> List[Dict]:
+    """取出结果行并转换时间戳字段为 ISO 8601 格式
+
+    不含时间戳列的查询（如仅取 id 的归属校验）直接返回 sqlite3.Row 列表，
+    它同样支持按列名 []、keys() 与 dict(row)，但没有 get()。
+    """
+    rows = cursor.fetchall()
+    if not rows:
+        return rows
+    # 时间戳列的位置按 cursor.description 每条查询只计算一次
+    names = [column[0] for column in cursor.description]
+    ts_names = [name for name in names if name in _TIMESTAMP_FIELDS]
+    if not ts_names:
+        return rows
+    converted_results = []
+    for row in rows:
+        # 直接由 Row 构建 dict（C 层迭代），仅就地替换时间戳列
+        # 普通 dict 已提供 []、in、keys()、get()，无需再包一层对象
+        record = dict(zip(names, row))
+        for name in ts_names:
+            value = record[name]
+            if value:
+                record[name] = _iso_from_sqlite_ts(value)
+        converted_results.append(record)
+    return converted_results
+
+def execute_query(query: str, params: tuple = ()) -> List[Dict]:
     """执行查询"""
-    conn = sqlite3.connect(get_db_path())
-    conn.row_factory = sqlite3.Row
     try:
-        c = conn.cursor()
-        c.execute(query, params)
-        results = c.fetchall()
-        # 转换所有时间戳字段为 ISO 8601 格式
-        converted_results = []
-        for row in results:
-            row_dict = dict(row)
-            # 转换所有可能的时间戳字段
-            timestamp_fields = ['created_at', 'updated_at', 'last_message_at', 'edited_at']
-            for field in timestamp_fields:
-                if field in row_dict and row_dict[field]:
-                    row_dict[field] = convert_timestamp_to_iso(row_dict[field])
-            # 创建一个类似 Row 的对象，保持原有接口
-            class RowLike:
-                def __init__(self, data):
-                    self._data = data
-                    for key, value in data.items():
-                        setattr(self, key, value)
-                def __getitem__(self, key):
-                    return self._data[key]
-                def __contains__(self, key):
-                    return key in self._data
-                def keys(self):
-                    return self._data.keys()
-                def get(self, key, default=None):
-                    return self._data.get(key, default)
-            converted_results.append(RowLike(row_dict))
-        return converted_results if converted_results else results
+        return _convert_rows(get_conn().execute(query, params))
     except Exception as e:
         logger.error(f'数据库查询错误: {str(e)}, SQL: {query}, Params: {params}')
         raise
-    finally:
-        conn.close()
+
+def execute_exists(query: str, params: tuple = ()) -> bool:
+    """执行存在性查询（SELECT 1 ... LIMIT 1），只判断是否有行，不做任何行转换"""
+    try:
+        return get_conn().execute(query, params).fetchone() is not None
+    except Exception as e:
+        logger.error(f'数据库查询错误: {str(e)}, SQL: {query}, Params: {params}')
+        raise
+
+def execute_returning(query: str, params: tuple = ()) -> List[Dict]:
+    """执行带 RETURNING 子句的写操作，一次往返返回受影响的行"""
+    return execute_transaction([(query, params)])[0]
+
+def execute_transaction(statements: List[Tuple[str, tuple]]) -> List[List[Dict]]:
+    """在单个事务中依次执行多条语句，返回每条语句的结果行"""
+    query, params = None, None
+    with transaction() as conn:
+        try:
+            results = []
+            for query, params in statements:
+                results.append(_convert_rows(conn.execute(query, params)))
+            return results
+        except Exception as e:
+            logger.error(f'数据库事务错误: {str(e)}, SQL: {query}, Params: {params}')
+            raise
+
+def execute_many(query: str, seq_of_params: Iterable[tuple]) -> int:
+    """在单个事务中以 executemany 批量执行同一语句（只提交一次），返回受影响的行数"""
+    try:
+        with transaction() as conn:
+            return conn.executemany(query, seq_of_params).rowcount
+    except Exception as e:
+        logger.error(f'数据库批量执行错误: {str(e)}, SQL: {query}')
+        raise
+
+@contextmanager
+def transaction():
+    """开启单个写事务 (BEGIN IMMEDIATE)，正常退出时提交，异常时回滚"""
+    conn = get_conn()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
 
 def execute_update(query: str, params: tuple = ()) -> int:
     """执行更新，返回最后插入的ID"""
-    conn = sqlite3.connect(get_db_path())
-    conn.row_factory = sqlite3.Row
     try:
-        c = conn.cursor()
-        c.execute(query, params)
-        conn.commit()
-        return c.lastrowid
+        return get_conn().execute(query, params).lastrowid
     except Exception as e:
-        conn.rollback()
         logger.error(f'数据库更新错误: {str(e)}, SQL: {query}, Params: {params}')
         raise
-    finally:
-        conn.close()
@@ -1,31 +1,75 @@
 import logging
 import hashlib
 import base64
-from datetime import datetime
-from typing import Any, Tuple
-from flask import jsonify, Response, request, current_app
+import sqlite3
+import time
+from decimal import Decimal
+from functools import lru_cache
+from typing import Any, Callable, Dict, Mapping, Optional, Tuple, Union, get_args, get_origin, get_type_hints
+import orjson
+from flask import Response, request, current_app
+from flask.json.provider import DefaultJSONProvider
 from cryptography.fernet import Fernet
-from .db import execute_query
+from .db import execute_query, execute_exists
 
 logger = logging.getLogger(__name__)
 
+# JSON 序列化：数据库行（sqlite3.Row 及 execute_query 返回的行对象）直接按列名展开，无需先 dict()
+def _json_default(obj: Any) -> Any:
+    if isinstance(obj, sqlite3.Row) or hasattr(obj, 'keys'):
+        return {key: obj[key] for key in obj.keys()}
+    if isinstance(obj, Decimal):
+        return str(obj)
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+def json_response(payload: Any, status_code: int = 200) -> Response:
+    """基于 orjson 的 JSON 响应"""
+    return current_app.response_class(
+        orjson.dumps(payload, default=_json_default, option=orjson.OPT_NON_STR_KEYS),
+        status=status_code,
+        mimetype='application/json'
+    )
+
+class OrjsonProvider(DefaultJSONProvider):
+    """app.json 的 orjson 实现，jsonify 等 Flask 内置序列化同样走 orjson"""
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        return orjson.dumps(obj, default=_json_default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_NAIVE_UTC).decode()
+
+    def loads(self, s: Any, **kwargs: Any) -> Any:
+        return orjson.loads(s)
+
+# 响应时间戳：同一秒内复用已格式化的秒级前缀，只拼接微秒部分
+# (秒, 前缀) 作为一个元组整体替换，多线程下读到的两者总是一致的
+_ts_cache = (-1, '')
+
+def _utc_timestamp() -> str:
+    """当前 UTC 时间的 ISO 8601 字符串，如 2024-01-01T00:00:00.123456Z"""
+    global _ts_cache
+    now = time.time()
+    second = int(now)
+    cached_second, prefix = _ts_cache
+    if second != cached_second:
+        prefix = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(second))
+        _ts_cache = (second, prefix)
+    return f'{prefix}.{int((now - second) * 1_000_000):06d}Z'
+
 # 统一响应格式
 def success_response(data: Any = None, message: str = '操作成功') -> Response:
     """成功响应"""
-    return jsonify({
+    return json_response({
         'success': True,
         'message': message,
         'data': data,
-        'timestamp': datetime.utcnow().isoformat() + 'Z'
+        'timestamp': _utc_timestamp()
     })
 
 def error_response(message: str, error_code: str = 'ERROR', status_code: int = 400) -> Response:
     """错误响应"""
-    return jsonify({
+    return json_response({
         'success': False,
         'message': message,
         'error_code': error_code,
-        'timestamp': datetime.utcnow().isoformat() + 'Z'
+        'timestamp': _utc_timestamp()
     }), status_code
 
 # API Key 加密/解密
@@ -36,10 +80,19 @@ def get_encryption_key() -> bytes:
     key_hash = hashlib.sha256(secret_key.encode()).digest()
     return base64.urlsafe_b64encode(key_hash)
 
+@lru_cache(maxsize=4)
+def _fernet_for(secret_key: str) -> Fernet:
+    key_hash = hashlib.sha256(secret_key.encode()).digest()
+    return Fernet(base64.urlsafe_b64encode(key_hash))
+
+def _get_fernet() -> Fernet:
+    """按 SECRET_KEY 缓存 Fernet 实例，免去每次加解密重新派生密钥"""
+    return _fernet_for(current_app.config['SECRET_KEY'])
+
 def encrypt_api_key(api_key: str) -> str:
     """加密 API Key"""
     try:
-        f = Fernet(get_encryption_key())
+        f = _get_fernet()
         encrypted = f.encrypt(api_key.encode())
         return encrypted.decode()
     except Exception as e:
@@ -49,39 +102,142 @@ def encrypt_api_key(api_key: str) -> str:
 def decrypt_api_key(encrypted_key: str) -> str:
     """解密 API Key"""
     try:
-        f = Fernet(get_encryption_key())
+        f = _get_fernet()
         decrypted = f.decrypt(encrypted_key.encode())
         return decrypted.decode()
     except Exception as e:
         logger.error(f'解密 API Key 失败: {str(e)}')
         raise
 
+# 请求体解析与校验
+# 类型规格：(容器类型, 列表元素类型或 None) 的候选元组，Union 展开为多个候选
+_TypeSpec = Tuple[Tuple[type, Optional[type]], ...]
+
+def _type_spec(hint: Any) -> _TypeSpec:
+    origin = get_origin(hint)
+    if origin is Union:
+        return tuple(spec for arg in get_args(hint) for spec in _type_spec(arg))
+    if origin is list:
+        args = get_args(hint)
+        return ((list, args[0] if args and args[0] is not Any else None),)
+    return ((origin or hint, None),)
+
+def _is_a(value: Any, expected: type) -> bool:
+    """isinstance，但 bool 不当作 int（JSON 的 true 不是合法的 ID）"""
+    return isinstance(value, expected) and (expected is bool or not isinstance(value, bool))
+
+def _matches(value: Any, spec: _TypeSpec) -> bool:
+    return any(
+        _is_a(value, container) and (element is None or all(_is_a(item, element) for item in value))
+        for container, element in spec
+    )
+
+@lru_cache(maxsize=None)
+def _schema_spec(schema: type) -> Tuple[Tuple[str, ...], Dict[str, _TypeSpec]]:
+    """从 TypedDict 提取 (必需字段, 字段 -> 类型规格)，List[X] 会逐个校验元素类型"""
+    hints = get_type_hints(schema)
+    required = tuple(field for field in hints if field in schema.__required_keys__)
+    types = {field: _type_spec(hint) for field, hint in hints.items()}
+    return required, types
+
+def parse_body(schema: type, allow_empty: bool = False) -> Tuple[Optional[Dict], Optional[str]]:
+    """以 orjson 解析请求体，并按 TypedDict 一次性校验必需字段与类型，返回 (data, 错误信息)
+
+    allow_empty 为 True 时，缺省的请求体视为 {}
+    """
+    try:
+        data = orjson.loads(request.get_data() or b'null')
+    except orjson.JSONDecodeError:
+        data = None
+    if data is None and allow_empty:
+        data = {}
+    if not isinstance(data, dict):
+        return None, '缺少请求数据'
+    required, types = _schema_spec(schema)
+    if any(not data.get(field) for field in required):
+        return None, f'缺少必需字段：{", ".join(required)}'
+    for field, spec in types.items():
+        value = data.get(field)
+        if value is not None and not _matches(value, spec):
+            return None, f'字段类型错误：{field}'
+    return data, None
+
+# 后台任务
+def submit_background(fn: Callable, *args, **kwargs):
+    """提交到应用级后台线程池执行（带应用上下文），异常仅记录日志"""
+    app = current_app._get_current_object()
+
+    def run():
+        with app.app_context():
+            try:
+                fn(*args, **kwargs)
+            except Exception as e:
+                logger.error(f'后台任务 {getattr(fn, "__name__", fn)} 执行失败: {str(e)}', exc_info=True)
+
+    return app.extensions['background_executor'].submit(run)
+
 # 资源验证辅助函数
+# 白名单验证表名，防止SQL注入，使用字典映射避免字符串拼接
+# messages 表没有 user_id 列，归属通过所在对话判断
+_OWNERSHIP_QUERIES = {
+    'conversations': 'SELECT 1 FROM conversations WHERE id = ? AND user_id = ? LIMIT 1',
+    'memories': 'SELECT 1 FROM memories WHERE id = ? AND user_id = ? LIMIT 1',
+    'messages': 'SELECT 1 FROM messages m JOIN conversations c ON m.conversation_id = c.id WHERE m.id = ? AND c.user_id = ? LIMIT 1',
+    'user_model_configs': 'SELECT 1 FROM user_model_configs WHERE id = ? AND user_id = ? LIMIT 1'
+}
+
 def verify_resource_ownership(table: str, resource_id: int, user_id: int) -> bool:
     """验证资源是否属于指定用户"""
-    # 白名单验证表名，防止SQL注入，使用字典映射避免字符串拼接
+    query = _OWNERSHIP_QUERIES.get(table)
+    if query is None:
+        logger.warning(f'非法的表名: {table}')
+        return False
+    return execute_exists(query, (resource_id, user_id))
+
+def fetch_owned(table: str, resource_id: int, user_id: int) -> Optional[Any]:
+    """一次查询同时完成归属校验与取行，不存在或无权限时返回 None"""
     table_queries = {
-        'conversations': 'SELECT id FROM conversations WHERE id = ? AND user_id = ?',
-        'memories': 'SELECT id FROM memories WHERE id = ? AND user_id = ?',
-        'messages': 'SELECT id FROM messages WHERE id = ? AND user_id = ?',
-        'user_model_configs': 'SELECT id FROM user_model_configs WHERE id = ? AND user_id = ?'
+        'conversations': 'SELECT * FROM conversations WHERE id = ? AND user_id = ?',
+        'memories': 'SELECT * FROM memories WHERE id = ? AND user_id = ?',
+        'messages': 'SELECT m.* FROM messages m JOIN conversations c ON m.conversation_id = c.id WHERE m.id = ? AND c.user_id = ?',
+        'user_model_configs': 'SELECT * FROM user_model_configs WHERE id = ? AND user_id = ?'
     }
     if table not in table_queries:
         logger.warning(f'非法的表名: {table}')
-        return False
+        return None
     result = execute_query(table_queries[table], (resource_id, user_id))
-    return bool(result)
+    return result[0] if result else None
 
 # 分页参数提取
-def get_pagination_params(default_limit: int = 20, max_limit: int = 100) -> Tuple[int, int, int]:
-    """提取分页参数"""
-    try:
-        page = max(1, int(request.args.get('page', 1)))
-    except (ValueError, TypeError):
-        page = 1
+_MAX_PAGE = 1_000_000
+
+def _int_arg(args: Mapping, name: str, default: int, lo: int, hi: int) -> int:
+    """读取整数查询参数并夹到 [lo, hi]，缺失或非法时返回默认值"""
+    value = args.get(name)
+    if value is None:
+        return default
     try:
-        limit = min(max(1, int(request.args.get('limit', default_limit))), max_limit)
+        return min(max(int(value), lo), hi)
     except (ValueError, TypeError):
-        limit = default_limit
+        return default
+
+def get_pagination_params(default_limit: int = 20, max_limit: int = 100) -> Tuple[int, int, int]:
+    """提取分页参数"""
+    args = request.args
+    page = _int_arg(args, 'page', 1, 1, _MAX_PAGE)
+    limit = _int_arg(args, 'limit', default_limit, 1, max_limit)
     offset = (page - 1) * limit
     return page, limit, offset
+
+# 游标分页参数（keyset 分页，避免 OFFSET 线性扫描和 COUNT(*)）
+def encode_cursor(timestamp: str, row_id: int) -> str:
+    """生成游标：'<ISO 时间戳>,<id>'"""
+    return f'{timestamp},{row_id}'
+
+def decode_cursor(cursor: str) -> Optional[Tuple[str, int]]:
+    """解析游标，返回 (SQLite 时间戳, id)，格式非法时返回 None"""
+    try:
+        timestamp, row_id = cursor.rsplit(',', 1)
+        return timestamp.replace('T', ' ').rstrip('Z'), int(row_id)
+    except (ValueError, AttributeError):
+        return None
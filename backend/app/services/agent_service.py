@@ -1,10 +1,15 @@
 # backend/app/services/agent_service.py
 
+import atexit
 import json
 import logging
+import orjson
 import concurrent.futures
 import re
-from typing import List, Dict, Optional, Union, Any
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Dict, Optional, Union, Any, Iterator, Tuple
 from flask import current_app
 
 try:
@@ -17,19 +22,65 @@ except ImportError:
 
 from ..core.utils import decrypt_api_key
 from ..core.db import execute_query
-from openai import OpenAI
+from openai import OpenAI, DefaultHttpxClient
+import httpx
 
 logger = logging.getLogger(__name__)
 
+# 所有 OpenAI 客户端共用的 httpx 连接池：不同用户访问同一 base_url 时复用 keep-alive 连接，免去 TLS 握手
+shared_http_client = DefaultHttpxClient(limits=httpx.Limits(max_connections=200, max_keepalive_connections=100))
+
+# 用户模型配置 / LLM 客户端缓存：每轮对话免去查库、解密和客户端构建
+_LLM_CACHE_TTL = 60  # 秒
+_LLM_CACHE_MAXSIZE = 1024
+
+# 审查模型回复中 ```json [...] ``` 代码块内的 ID 列表
+_FENCED_JSON_RE = re.compile(r'```(?:json)?\s*(\[.*?\])\s*```', re.DOTALL)
+
+# 审查提示中每条候选记忆的内容截断长度（判断是否匹配无需全文）
+_REVIEW_CONTENT_MAX = 200
+
+# 删除工具两次辅助调用的输出上限：审查只返回 ID 列表（最多 20 个 UUID），重置声明只有一句话
+_REVIEW_MAX_TOKENS = 512
+_NEUTRALIZE_MAX_TOKENS = 64
+
+# 每轮送入模型的历史消息 token 预算（在最近 N 条窗口之上再按长度截断）
+_HISTORY_TOKEN_BUDGET = 4096
+
+def _estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：非 ASCII 字符（中文等）约 1 token/字，ASCII 约 4 字符/token"""
+    ascii_len = len(text.encode('ascii', 'ignore'))
+    return (len(text) - ascii_len) + ascii_len // 4 + 1
+
+def _prepare_history(history_messages: List[Tuple[str, str]], budget: int = _HISTORY_TOKEN_BUDGET) -> List[Tuple[str, str]]:
+    """从最新消息往前保留，直到用完 token 预算，超长会话的提示长度不再随会话增长"""
+    kept = 0
+    used = 0
+    for _, content in reversed(history_messages):
+        used += _estimate_tokens(content)
+        if used > budget: break
+        kept += 1
+    return history_messages[len(history_messages) - kept:]
+
 class AgentService:
     """智能体服务 - Graph RAG (Vector + Graph) + 全域同步一致性删除"""
     
     def __init__(self):
         self.memory_manager = None
         self.agent_service_url = None
+        # user_id -> {'expires_at', 'config', 'client'}
+        self._llm_cache: 'OrderedDict[int, Dict]' = OrderedDict()
+        self._llm_cache_lock = threading.Lock()
+        # 各轮对话、各用户共享的工具调用线程池，在 init_app 中创建
+        self._tool_executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
 
     def init_app(self, app):
         self.agent_service_url = app.config.get('AGENT_SERVICE_URL')
+        if self._tool_executor is None:
+            self._tool_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=app.config['AGENT_TOOL_WORKERS'], thread_name_prefix='agent-tool'
+            )
+            atexit.register(self._tool_executor.shutdown, wait=False)
         try:
             self.memory_manager = MemoryManager()
             logger.info("MemoryManager initialized successfully via init_app")
@@ -37,7 +88,7 @@ class AgentService:
             logger.error(f"Failed to initialize MemoryManager: {e}")
             self.memory_manager = None
 
-    def _get_user_model_config(self, user_id: int) -> Optional[Dict]:
+    def _load_user_model_config(self, user_id: int) -> Optional[Dict]:
         try:
             config = execute_query('SELECT provider, model_name, api_key, base_url FROM user_model_configs WHERE user_id = ? AND is_default = 1 LIMIT 1', (user_id,))
             if config:
@@ -49,96 +100,131 @@ class AgentService:
             logger.error(f'获取用户模型配置失败: {str(e)}')
             return None
 
+    def _get_llm_entry(self, user_id: int) -> Optional[Dict]:
+        """取用户的缓存条目（默认模型配置 + 惰性创建的客户端），过期或未命中时重新加载"""
+        now = time.monotonic()
+        with self._llm_cache_lock:
+            entry = self._llm_cache.get(user_id)
+            if entry is not None and entry['expires_at'] > now:
+                self._llm_cache.move_to_end(user_id)
+                return entry
+        config = self._load_user_model_config(user_id)
+        if not config: return None
+        entry = {'expires_at': now + _LLM_CACHE_TTL, 'config': config, 'client': None}
+        with self._llm_cache_lock:
+            self._llm_cache[user_id] = entry
+            self._llm_cache.move_to_end(user_id)
+            while len(self._llm_cache) > _LLM_CACHE_MAXSIZE:
+                self._llm_cache.popitem(last=False)
+        return entry
+
+    def invalidate_user_llm(self, user_id: int):
+        """模型配置变更后丢弃该用户的缓存配置与客户端"""
+        with self._llm_cache_lock:
+            self._llm_cache.pop(user_id, None)
+
+    def _get_user_model_config(self, user_id: int) -> Optional[Dict]:
+        entry = self._get_llm_entry(user_id)
+        return entry['config'] if entry else None
+
     def _get_llm_client(self, user_id: int):
-        model_config = self._get_user_model_config(user_id)
-        if not model_config: return None, None, None
-        try:
-            client = OpenAI(api_key=model_config['api_key'], base_url=model_config['base_url'])
-            return client, model_config['model_name'], model_config
-        except Exception as e:
-            logger.error(f'创建 LLM Client 失败: {str(e)}')
-            return None, None, None
+        entry = self._get_llm_entry(user_id)
+        if not entry: return None, None, None
+        model_config = entry['config']
+        client = entry['client']
+        if client is None:
+            try:
+                client = OpenAI(api_key=model_config['api_key'], base_url=model_config['base_url'], http_client=shared_http_client)
+            except Exception as e:
+                logger.error(f'创建 LLM Client 失败: {str(e)}')
+                return None, None, None
+            entry['client'] = client
+        return client, model_config['model_name'], model_config
 
     def warm_up_for_user(self, user_id: int):
         try:
             config = self._get_user_model_config(user_id)
             if self.memory_manager: self.memory_manager.warm_up_client(config)
-        except: pass
+        except Exception as e:
+            # 预热失败时首轮对话会承担冷启动开销，记录下来便于排查
+            logger.warning(f"用户 {user_id} 预热失败: {e}", exc_info=logger.isEnabledFor(logging.DEBUG))
 
     # =========================================================================
     # 1. 工具定义
     # =========================================================================
-    def _get_tools(self) -> List[Dict]:
-        return [
-            {
-                "type": "function",
-                "function": {
-                    "name": "add_local_memory",
-                    "description": "【存局部】保存仅与当前对话相关的细节。",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {"content": {"type": "string", "description": "记忆内容"}},
-                        "required": ["content"]
-                    }
+    # 工具定义与系统提示为常量，类加载时构建一次，各轮对话共享同一引用（勿修改）
+    _TOOLS: List[Dict] = [
+        {
+            "type": "function",
+            "function": {
+                "name": "add_local_memory",
+                "description": "【存局部】保存仅与当前对话相关的细节。",
+                "parameters": {
+                    "type": "object",
+                    "properties": {"content": {"type": "string", "description": "记忆内容"}},
+                    "required": ["content"]
                 }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "add_global_memory",
-                    "description": "【存全局】保存用户的永久性事实。系统会自动更新知识图谱。",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {"content": {"type": "string", "description": "记忆内容"}},
-                        "required": ["content"]
-                    }
+            }
+        },
+        {
+            "type": "function",
+            "function": {
+                "name": "add_global_memory",
+                "description": "【存全局】保存用户的永久性事实。系统会自动更新知识图谱。",
+                "parameters": {
+                    "type": "object",
+                    "properties": {"content": {"type": "string", "description": "记忆内容"}},
+                    "required": ["content"]
                 }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "search_local_memories",
-                    "description": "【搜局部】同时返回文本记忆和图谱关系。",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {"query": {"type": "string", "description": "搜索关键词"}},
-                        "required": ["query"]
-                    }
+            }
+        },
+        {
+            "type": "function",
+            "function": {
+                "name": "search_local_memories",
+                "description": "【搜局部】同时返回文本记忆和图谱关系。",
+                "parameters": {
+                    "type": "object",
+                    "properties": {"query": {"type": "string", "description": "搜索关键词"}},
+                    "required": ["query"]
                 }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "search_global_memories",
-                    "description": "【搜全局】同时返回文本记忆和图谱关系。",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {"query": {"type": "string", "description": "搜索关键词"}},
-                        "required": ["query"]
-                    }
+            }
+        },
+        {
+            "type": "function",
+            "function": {
+                "name": "search_global_memories",
+                "description": "【搜全局】同时返回文本记忆和图谱关系。",
+                "parameters": {
+                    "type": "object",
+                    "properties": {"query": {"type": "string", "description": "搜索关键词"}},
+                    "required": ["query"]
                 }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "delete_memory",
-                    "description": "【删除记忆】用户要求'忘记'或'删除'时使用。会同时清理向量和图谱。",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "content": {"type": "string", "description": "要删除的具体事实描述"}
-                        },
-                        "required": ["content"]
-                    }
+            }
+        },
+        {
+            "type": "function",
+            "function": {
+                "name": "delete_memory",
+                "description": "【删除记忆】用户要求'忘记'或'删除'时使用。会同时清理向量和图谱。",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "content": {"type": "string", "description": "要删除的具体事实描述"}
+                    },
+                    "required": ["content"]
                 }
             }
-        ]
+        }
+    ]
+
+    def _get_tools(self) -> List[Dict]:
+        return self._TOOLS
 
     # =========================================================================
     # 2. System Prompt
     # =========================================================================
-    def _build_system_prompt(self) -> str:
-        return """你是一个拥有双层记忆系统的智能助手。
+    _SYSTEM_PROMPT = """你是一个拥有双层记忆系统的智能助手。
 
 **记忆架构：**
 1. **局部记忆**：当前对话上下文。
@@ -154,16 +240,21 @@ class AgentService:
 3. **删除 (Delete)**：用户明确要求删除时调用。
 4. **搜索 (Search)**：先搜局部，再搜全局。
 """
+    _SYSTEM_MESSAGE = {"role": "system", "content": _SYSTEM_PROMPT}
+
+    def _build_system_prompt(self) -> str:
+        return self._SYSTEM_PROMPT
 
     # =========================================================================
     # 3. 工具执行 (全域同步修复版)
     # =========================================================================
-    def _execute_tool(self, tool_name: str, tool_args: Dict, user_id: int, conversation_id: int, llm_settings: Dict) -> str:
+    def _execute_tool(self, tool_name: str, tool_args: Dict, user_id: int, conversation_id: int, llm_settings: Dict, client: Optional[OpenAI] = None) -> str:
         logger.info(f"🔧 Agent 执行工具: {tool_name} | 参数: {tool_args}")
         if not self.memory_manager: return "错误：记忆模块未初始化。"
 
         try:
-            def parse_search_result(res):
+            def parse_search_result(res, with_ids=True):
+                # with_ids=False 时直接返回内容字符串列表，省去逐条 dict 包装
                 vectors = []
                 relations = []
                 raw_list = []
@@ -172,9 +263,10 @@ class AgentService:
                 
                 for m in raw_list:
                     if isinstance(m, dict):
-                        vectors.append({"id": m.get("id"), "content": m.get("memory") or m.get("text") or str(m)})
+                        content = m.get("memory") or m.get("text") or str(m)
+                        vectors.append({"id": m.get("id"), "content": content} if with_ids else content)
                     elif isinstance(m, str):
-                        vectors.append({"content": m})
+                        vectors.append({"content": m} if with_ids else m)
 
                 if isinstance(res, dict) and "relations" in res:
                     for rel in res["relations"]:
@@ -189,10 +281,15 @@ class AgentService:
             if tool_name == "delete_memory":
                 query_content = tool_args["content"]
                 
-                # A. 搜索 (包含局部和全局，且不丢弃图谱)
+                # A. 搜索 (包含局部和全局，且不丢弃图谱)；两次检索相互独立：
+                # 局部检索交给共享工具线程池，全局检索在当前线程执行。本函数自身也运行在该线程池中，
+                # 局部检索若仍在排队就撤回并就地执行，线程池占满时不会互相等待而死锁
                 candidates = []
-                # 搜局部
-                local_raw = self.memory_manager.search_memories(query=query_content, user_id=str(user_id), run_id=str(conversation_id), scope='local', limit=10, llm_settings=llm_settings)
+                local_kwargs = dict(query=query_content, user_id=str(user_id), run_id=str(conversation_id), scope='local', limit=10, llm_settings=llm_settings)
+                local_future = self._tool_executor.submit(self.memory_manager.search_memories, **local_kwargs)
+                global_raw = self.memory_manager.search_memories(query=query_content, user_id=str(user_id), run_id=None, scope='global', limit=10, llm_settings=llm_settings)
+                local_raw = self.memory_manager.search_memories(**local_kwargs) if local_future.cancel() else local_future.result()
+                # 局部
                 vecs_local, rels_local = parse_search_result(local_raw) # [修复1] 之前是 _，现在捕获 relations
                 for v in vecs_local: 
                     if 'id' in v: candidates.append({"id": v['id'], "content": v['content'], "scope": "局部"})
@@ -200,8 +297,7 @@ class AgentService:
                 for r in rels_local:
                     candidates.append({"id": "graph_only", "content": f"[局部图谱残留] {r}", "scope": "局部"})
 
-                # 搜全局
-                global_raw = self.memory_manager.search_memories(query=query_content, user_id=str(user_id), run_id=None, scope='global', limit=10, llm_settings=llm_settings)
+                # 全局
                 vecs_global, rels_global = parse_search_result(global_raw)
                 for v in vecs_global: 
                     if 'id' in v: candidates.append({"id": v['id'], "content": v['content'], "scope": "全局"})
@@ -211,11 +307,14 @@ class AgentService:
                 if not candidates: return f"未找到与 '{query_content}' 相关的记忆。"
 
                 # B. 审查
-                reviewer_client = OpenAI(api_key=llm_settings['api_key'], base_url=llm_settings['base_url'])
+                # 复用本轮对话的客户端
+                reviewer_client = client or OpenAI(api_key=llm_settings['api_key'], base_url=llm_settings['base_url'], http_client=shared_http_client)
+                # 紧凑序列化 + 短键名 + 截断内容，减少提示 token
+                review_candidates = [{"id": c['id'], "c": c['content'][:_REVIEW_CONTENT_MAX], "s": c['scope']} for c in candidates]
                 review_prompt = f"""
                 用户指令：删除 "{query_content}"
-                候选记忆：
-                {json.dumps(candidates, ensure_ascii=False, indent=2)}
+                候选记忆（c=内容，s=范围）：
+                {orjson.dumps(review_candidates).decode()}
                 
                 请判断哪些条目必须删除？（仅删除事实匹配的）。
                 返回ID列表 JSON，如 ["id1"]。
@@ -223,12 +322,20 @@ class AgentService:
                 """
                 try:
                     review_res = reviewer_client.chat.completions.create(
-                        model=llm_settings['model_name'], messages=[{"role": "user", "content": review_prompt}], temperature=0
+                        model=llm_settings['model_name'], messages=[{"role": "user", "content": review_prompt}],
+                        temperature=0, max_tokens=_REVIEW_MAX_TOKENS
                     )
                     review_content = review_res.choices[0].message.content
-                    if "```" in review_content: review_content = re.search(r'```(?:json)?\s*(\[.*?\])\s*```', review_content, re.DOTALL).group(1)
-                    ids_to_delete = json.loads(review_content)
-                except: ids_to_delete = []
+                    if "```" in review_content:
+                        fenced = _FENCED_JSON_RE.search(review_content)
+                        if fenced: review_content = fenced.group(1)
+                    ids_to_delete = orjson.loads(review_content)
+                except (json.JSONDecodeError, TypeError) as e:
+                    logger.warning(f"审查结果解析失败，不删除任何记忆: {e}")
+                    ids_to_delete = []
+                except Exception as e:
+                    logger.error(f"审查模型调用失败: {e}")
+                    ids_to_delete = []
 
                 # C. 物理删除 (删除 Vector)
                 deleted_contents = []
@@ -258,32 +365,23 @@ class AgentService:
                     """
                     try:
                         neutralize_res = reviewer_client.chat.completions.create(
-                            model=llm_settings['model_name'], messages=[{"role": "user", "content": neutralize_prompt}], temperature=0
+                            model=llm_settings['model_name'], messages=[{"role": "user", "content": neutralize_prompt}],
+                            temperature=0, max_tokens=_NEUTRALIZE_MAX_TOKENS
                         )
                         neutral_statement = neutralize_res.choices[0].message.content.strip()
                         
-                        # [关键修复 2] 1. 重置全局 (Global)
-                        self.memory_manager.add_memory(
+                        # [关键修复 2] 同时重置全局 (Global) 与局部 (Local)，局部图谱的旧连接也会被 Unknown 覆盖
+                        reset_targets = [('global', None)]
+                        if conversation_id:
+                            reset_targets.append(('local', str(conversation_id)))
+                        self.memory_manager.add_memory_multi(
                             content=neutral_statement,
                             user_id=str(user_id),
-                            run_id=None,
-                            scope='global',
+                            targets=reset_targets,
                             metadata={"type": "graph_reset", "source": "delete_tool"},
                             llm_settings=llm_settings
                         )
-                        logger.info(f"🔄 图谱重置执行 (Global): {neutral_statement}")
-
-                        # [关键修复 2] 2. 重置局部 (Local) - 这样局部图谱的旧连接也会被 Unknown 覆盖
-                        if conversation_id:
-                            self.memory_manager.add_memory(
-                                content=neutral_statement,
-                                user_id=str(user_id),
-                                run_id=str(conversation_id),
-                                scope='local',
-                                metadata={"type": "graph_reset", "source": "delete_tool"},
-                                llm_settings=llm_settings
-                            )
-                            logger.info(f"🔄 图谱重置执行 (Local): {neutral_statement}")
+                        logger.info(f"🔄 图谱重置执行 ({'/'.join(scope for scope, _ in reset_targets)}): {neutral_statement}")
 
                     except Exception as e:
                         logger.error(f"图谱重置失败: {e}")
@@ -302,15 +400,17 @@ class AgentService:
             elif "search" in tool_name:
                 res = self.memory_manager.search_memories(query=tool_args["query"], user_id=str(user_id), run_id=run_id, scope=scope, limit=5, llm_settings=llm_settings)
                 
-                logger.info(f"🔎 [RAW Search Result] ({scope}): {res}")
-                vectors, relations = parse_search_result(res)
+                # 原始结果可能很大，INFO 关闭时不做格式化
+                if logger.isEnabledFor(logging.INFO):
+                    logger.info(f"🔎 [RAW Search Result] ({scope}): {res}")
+                contents, relations = parse_search_result(res, with_ids=False)
                 
                 output_data = {
-                    "relevant_memories": [v['content'] for v in vectors],
+                    "relevant_memories": contents,
                     "knowledge_graph_connections": relations
                 }
                 
-                final_output = f"{'局部' if scope=='local' else '全局'}搜索结果: {json.dumps(output_data, ensure_ascii=False)}"
+                final_output = f"{'局部' if scope=='local' else '全局'}搜索结果: {orjson.dumps(output_data).decode()}"
                 logger.info(f"📤 [To LLM]: {final_output}")
                 return final_output
             
@@ -320,13 +420,54 @@ class AgentService:
             logger.error(f"工具执行异常: {e}", exc_info=True)
             return f"工具执行出错: {str(e)}"
 
+    def _execute_tool_with_raw_args(self, tool_name: str, raw_args: str, user_id: int, conversation_id: int, llm_settings: Dict, client: Optional[OpenAI] = None) -> str:
+        """在工作线程内解析 JSON 参数后执行工具，参数非法时按空参数处理"""
+        try: arguments = orjson.loads(raw_args)
+        except (orjson.JSONDecodeError, TypeError) as e:
+            logger.warning(f"工具 {tool_name} 参数不是合法 JSON，按空参数处理: {e} | 原始参数: {raw_args!r}")
+            arguments = {}
+        return self._execute_tool(tool_name, arguments, user_id, conversation_id, llm_settings, client)
+
+    def _execute_tool_calls(self, tool_calls: List[Dict], user_id: int, conversation_id: int, llm_settings: Dict, client: Optional[OpenAI] = None) -> List[Dict]:
+        """并发执行一轮工具调用，按调用顺序返回 tool 消息"""
+        tool_messages = []
+        # 同一轮有多个不同的检索查询时，先一次批量请求完成查询向量化，各检索随后直接命中向量缓存
+        search_queries = set()
+        for tool_call in tool_calls:
+            if tool_call["name"].startswith("search_"):
+                try: query = orjson.loads(tool_call["arguments"]).get("query")
+                except (orjson.JSONDecodeError, AttributeError): query = None
+                if isinstance(query, str): search_queries.add(query)
+        if len(search_queries) > 1 and self.memory_manager:
+            self.memory_manager.prefetch_search_embeddings(list(search_queries), llm_settings=llm_settings)
+
+        # 先连续提交全部调用（参数在工作线程内解析），再按调用顺序收集结果
+        # 同一轮内参数完全相同的搜索调用只执行一次，结果分发给各自的 tool_call_id（搜索只读，可共享）
+        futures = []
+        search_futures: Dict[Tuple[str, str], concurrent.futures.Future] = {}
+        for tool_call in tool_calls:
+            key = (tool_call["name"], tool_call["arguments"])
+            future = search_futures.get(key) if key[0].startswith("search_") else None
+            if future is None:
+                future = self._tool_executor.submit(self._execute_tool_with_raw_args, tool_call["name"], tool_call["arguments"], user_id, conversation_id, llm_settings, client)
+                if key[0].startswith("search_"): search_futures[key] = future
+            futures.append((tool_call, future))
+        for tool_call, future in futures:
+            tool_result = future.result()
+            tool_messages.append({"tool_call_id": tool_call["id"], "role": "tool", "name": tool_call["name"], "content": tool_result})
+        return tool_messages
+
+    def _build_messages(self, user_message: str, history_messages: List[Tuple[str, str]]) -> List[Dict]:
+        messages = [self._SYSTEM_MESSAGE]
+        messages.extend({"role": role, "content": content} for role, content in _prepare_history(history_messages))
+        messages.append({"role": "user", "content": user_message})
+        return messages
+
     # Agent Loop (保持不变)
-    def chat_agent(self, user_id: int, conversation_id: int, user_message: str, history_messages: List[Dict]) -> str:
+    def chat_agent(self, user_id: int, conversation_id: int, user_message: str, history_messages: List[Tuple[str, str]]) -> str:
         client, model_name, llm_settings = self._get_llm_client(user_id)
         if not client: return "请先配置模型 API Key。"
-        messages = [{"role": "system", "content": self._build_system_prompt()}]
-        messages.extend(history_messages)
-        messages.append({"role": "user", "content": user_message})
+        messages = self._build_messages(user_message, history_messages)
         tools = self._get_tools()
         max_turns = 5
         current_turn = 0
@@ -336,24 +477,80 @@ class AgentService:
                 response_message = response.choices[0].message
                 if response_message.tool_calls:
                     messages.append(response_message)
-                    with concurrent.futures.ThreadPoolExecutor() as executor:
-                        futures = []
-                        for tool_call in response_message.tool_calls:
-                            function_name = tool_call.function.name
-                            try: arguments = json.loads(tool_call.function.arguments)
-                            except: arguments = {}
-                            future = executor.submit(self._execute_tool, function_name, arguments, user_id, conversation_id, llm_settings)
-                            futures.append((tool_call, future))
-                        for tool_call, future in futures:
-                            tool_result = future.result()
-                            messages.append({"tool_call_id": tool_call.id, "role": "tool", "name": tool_call.function.name, "content": tool_result})
+                    tool_calls = [
+                        {"id": tc.id, "name": tc.function.name, "arguments": tc.function.arguments}
+                        for tc in response_message.tool_calls
+                    ]
+                    messages.extend(self._execute_tool_calls(tool_calls, user_id, conversation_id, llm_settings, client))
                     current_turn += 1
                 else: return response_message.content
             except Exception as e: return f"处理错误: {str(e)}"
         return "思考超时。"
+
+    def chat_agent_stream(self, user_id: int, conversation_id: int, user_message: str, history_messages: List[Tuple[str, str]]) -> Iterator[Dict]:
+        """流式 Agent Loop：逐 token 产出回答，工具调用以 tool 事件穿插其中
+        （tool 事件之前的 token 属于中间轮次，最终回答只由最后一个 tool 事件之后的 token 组成）"""
+        client, model_name, llm_settings = self._get_llm_client(user_id)
+        if not client:
+            yield {"type": "token", "content": "请先配置模型 API Key。"}
+            return
+        messages = self._build_messages(user_message, history_messages)
+        tools = self._get_tools()
+        max_turns = 5
+        current_turn = 0
+        while current_turn < max_turns:
+            try:
+                stream = client.chat.completions.create(model=model_name, messages=messages, tools=tools, tool_choice="auto", temperature=0.7, stream=True)
+                content_parts = []
+                pending_calls: Dict[int, Dict] = {}
+                for chunk in stream:
+                    if not chunk.choices: continue
+                    delta = chunk.choices[0].delta
+                    if delta.content:
+                        content_parts.append(delta.content)
+                        yield {"type": "token", "content": delta.content}
+                    # 工具调用参数以增量片段到达，按 index 拼接
+                    for tc in delta.tool_calls or []:
+                        call = pending_calls.setdefault(tc.index, {"id": None, "name": "", "arguments": ""})
+                        if tc.id: call["id"] = tc.id
+                        if tc.function:
+                            if tc.function.name: call["name"] += tc.function.name
+                            if tc.function.arguments: call["arguments"] += tc.function.arguments
+                if not pending_calls: return
+
+                tool_calls = [pending_calls[i] for i in sorted(pending_calls)]
+                messages.append({
+                    "role": "assistant",
+                    "content": "".join(content_parts) or None,
+                    "tool_calls": [
+                        {"id": tc["id"], "type": "function", "function": {"name": tc["name"], "arguments": tc["arguments"]}}
+                        for tc in tool_calls
+                    ]
+                })
+                for tc in tool_calls:
+                    yield {"type": "tool", "name": tc["name"]}
+                messages.extend(self._execute_tool_calls(tool_calls, user_id, conversation_id, llm_settings, client))
+                current_turn += 1
+            except Exception as e:
+                yield {"type": "token", "content": f"处理错误: {str(e)}"}
+                return
+        yield {"type": "token", "content": "思考超时。"}
         
+    def delete_conversation_memories_bulk(self, user_id: int, conversation_ids: List[int]):
+        """批量删除多个对话的局部记忆（复用同一个客户端）"""
+        if not self.memory_manager or not conversation_ids: return
+        try:
+            llm_settings = self._get_user_model_config(user_id)
+            self.memory_manager.delete_conversations_memories(
+                str(user_id), [str(cid) for cid in conversation_ids], llm_settings=llm_settings
+            )
+        except Exception as e:
+            logger.error(f"批量删除对话记忆失败: {e}")
+
+    def delete_conversation_memories(self, user_id: int, conversation_id: int):
+        self.delete_conversation_memories_bulk(user_id, [conversation_id])
+
     # 兼容方法
-    def delete_conversation_memories(self, *args): pass
     def search_memories(self, *args, **kwargs): return []
     def sync_memory(self, *args, **kwargs): return {}
     def update_memory(self, *args, **kwargs): pass
@@ -1,14 +1,28 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
 from qdrant_client import QdrantClient
 from qdrant_client.http.models import Distance, VectorParams
 
+def _try_delete(client, name):
+    try:
+        print(f"Attempting to delete collection: {name}")
+        client.delete_collection(name)
+        print(f"Deleted {name}")
+    except Exception as e:
+        print(f"Failed to delete {name}: {e}")
+
 def clean_qdrant():
     host = os.getenv("QDRANT_HOST", "localhost")
     port = int(os.getenv("QDRANT_PORT", 6333))
     
     print(f"Connecting to Qdrant at {host}:{port}...")
     try:
-        client = QdrantClient(host=host, port=port)
+        client = QdrantClient(
+            host=host,
+            port=port,
+            grpc_port=int(os.getenv("QDRANT_GRPC_PORT", 6334)),
+            prefer_grpc=os.getenv("QDRANT_PREFER_GRPC", "true").lower() == "true",
+        )
         collections = client.get_collections()
         print(f"Current collections: {[c.name for c in collections.collections]}")
         
@@ -16,13 +30,9 @@ def clean_qdrant():
         # and the test collection
         targets = ["mem0migrations", "mem0_test_crud", "mem0"]
         
-        for name in targets:
-            try:
-                print(f"Attempting to delete collection: {name}")
-                client.delete_collection(name)
-                print(f"Deleted {name}")
-            except Exception as e:
-                print(f"Failed to delete {name}: {e}")
+        # 各集合相互独立，并发删除
+        with ThreadPoolExecutor(max_workers=len(targets)) as executor:
+            list(executor.map(lambda name: _try_delete(client, name), targets))
                 
     except Exception as e:
         print(f"Fatal error connecting/cleaning Qdrant: {e}")
@@ -6,6 +6,7 @@
 
 import sys
 import time
+import unicodedata
 from typing import Optional
 from dotenv import load_dotenv
 from memory_agent import ConversationalMemoryAgent, MemoryToolManager
@@ -15,6 +16,22 @@ from config import MEM0_CONFIG
 # 加载环境变量
 load_dotenv()
 
+
+def wrap_display_width(line: str, max_width: int) -> list:
+    """按终端显示宽度折行（中日韩全角字符占 2 列），单次线性扫描"""
+    chunks = []
+    start = 0
+    width = 0
+    for i, ch in enumerate(line):
+        ch_width = 2 if unicodedata.east_asian_width(ch) in ('W', 'F') else 1
+        if width + ch_width > max_width and i > start:
+            chunks.append(line[start:i])
+            start = i
+            width = 0
+        width += ch_width
+    chunks.append(line[start:])
+    return chunks
+
 class InteractiveChatUI:
     """交互式聊天界面"""
 
@@ -65,15 +82,8 @@ class InteractiveChatUI:
         formatted_lines = []
         
         for line in lines:
-            if len(line) <= max_width:
-                formatted_lines.append(line)
-            else:
-                # 长行进行折行
-                while len(line) > max_width:
-                    formatted_lines.append(line[:max_width])
-                    line = line[max_width:]
-                if line:
-                    formatted_lines.append(line)
+            # 长行按显示宽度折行
+            formatted_lines.extend(wrap_display_width(line, max_width))
         
         # 打印第一行（带前缀）
         if formatted_lines:
@@ -85,6 +95,19 @@ class InteractiveChatUI:
         
         self.print_separator()
 
+    def stream_response(self, chunks) -> str:
+        """边接收边打印助手回复，返回完整文本"""
+        color_code = "\033[92m"  # 绿色
+        reset_code = "\033[0m"
+        parts = []
+        print(f"{color_code}🤖 助手: ", end="", flush=True)
+        for chunk in chunks:
+            parts.append(chunk)
+            print(chunk, end="", flush=True)
+        print(reset_code)
+        self.print_separator()
+        return "".join(parts)
+
     def show_memories(self):
         """显示所有记忆"""
         if not self.tool_manager:
@@ -198,8 +221,9 @@ class InteractiveChatUI:
         if not user_input.startswith('/'):
             return True
         
-        command = user_input.lower().split()[0]
-        args = user_input.split()[1:] if len(user_input.split()) > 1 else []
+        parts = user_input.split()
+        command = parts[0].lower()
+        args = parts[1:]
         
         if command in ['/quit', '/exit']:
             print("\n👋 谢谢使用记忆代理系统！再见！\n")
@@ -258,12 +282,10 @@ class InteractiveChatUI:
                         print("\n🤔 正在处理您的消息...\n")
                         
                         start_time = time.time()
-                        response = self.agent.chat(user_input)
+                        # 流式显示响应：首个片段到达即开始输出
+                        self.stream_response(self.agent.chat_stream(user_input))
                         elapsed_time = time.time() - start_time
                         
-                        # 格式化和显示响应
-                        self.format_response("assistant", response)
-                        
                         # 显示统计信息
                         print(f"⏱️  响应时间: {elapsed_time:.2f}秒")
                         print(f"💬 对话轮数: {len(self.agent.conversation_history) // 2}\n")
@@ -7,7 +7,12 @@
 
 import json
 import logging
-from typing import Optional, Dict, List, Any
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Optional, Dict, List, Any, Iterator
 from dataclasses import dataclass
 
 from config import MEM0_CONFIG
@@ -22,6 +27,120 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+# 工具定义与系统提示在导入时构建一次，各轮对话共享（勿修改）
+_TOOLS: List[Dict] = [
+    {
+        "type": "function",
+        "function": {
+            "name": "add_memory",
+            "description": "向记忆系统添加新的记忆。当用户提供关于自己的信息时，应该调用此工具来存储这些信息。",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "content": {
+                        "type": "string",
+                        "description": "要存储的记忆内容。应该是关于用户的事实信息，例如：'用户叫张三，来自北京，是一名工程师'"
+                    }
+                },
+                "required": ["content"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "search_memories",
+            "description": "在记忆系统中搜索相关记忆。当需要查找关于用户的信息时调用此工具。",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "query": {
+                        "type": "string",
+                        "description": "搜索查询，例如：'用户的工作是什么？' 或 '用户的兴趣爱好'"
+                    },
+                    "limit": {
+                        "type": "integer",
+                        "description": "返回结果的最大数量，默认为5",
+                        "default": 5
+                    }
+                },
+                "required": ["query"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "delete_memory",
+            "description": "从记忆系统中删除特定的记忆。需要先通过search_memories或get_all_memories获取记忆ID，然后才能删除。",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "memory_id": {
+                        "type": "string",
+                        "description": "要删除的记忆的UUID（唯一标识符），通常是一个UUID字符串，例如：'0ec3af98-1b41-47c6-9704-9163f333153e'。必须从search_memories或get_all_memories的结果中获取。"
+                    }
+                },
+                "required": ["memory_id"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "get_all_memories",
+            "description": "获取存储的所有记忆。用于查看完整的记忆列表。",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "limit": {
+                        "type": "integer",
+                        "description": "返回的最大记忆数量，默认为20",
+                        "default": 20
+                    }
+                },
+                "required": []
+            }
+        }
+    },
+]
+
+_SYSTEM_PROMPT = """你是一个有帮助的AI助手，具有记忆管理能力。
+
+你可以使用以下工具来管理用户的记忆：
+1. add_memory - 添加新的记忆
+2. search_memories - 搜索相关记忆
+3. delete_memory - 删除记忆（需要使用从search_memories或get_all_memories返回的ID）
+4. get_all_memories - 获取所有记忆
+5. update_memory - 更新记忆
+
+**关键指导原则：**
+- 当用户提供关于自己的信息（如姓名、职业、兴趣、经历等）时，主动使用 add_memory 工具来存储这些信息
+- 当用户询问关于他们自己的问题时，先使用 search_memories 工具来查找相关记忆
+- 不要对用户说"我没有你的信息"，而是使用 search_memories 工具来查找
+- **删除记忆时的正确流程**：
+  1. 先调用 search_memories 或 get_all_memories 查找要删除的记忆
+  2. 从返回结果中获取记忆的ID（格式为 UUID）
+  3. 使用 delete_memory 工具并传入正确的 memory_id（不是记忆内容，而是ID！）
+- 保持对话自然流畅，在必要时才明确提及使用了记忆工具
+- 大多数情况下，用户更新信息时，直接使用 add_memory 会自动处理更新，无需显式删除
+- 定期总结用户的信息以保持准确性
+
+**重要提示：delete_memory 的 memory_id 参数必须是从搜索结果中获取的 UUID，不能是记忆的文本内容！**
+
+记住：用户希望通过对话来管理记忆，而不是手动操作。因此要主动、智能地使用这些工具。"""
+
+_SYSTEM_MESSAGE = {"role": "system", "content": _SYSTEM_PROMPT}
+
+
+# 检索结果缓存：同一问题在多轮迭代 / 多次对话中反复检索时，免去向量化与向量检索往返
+_SEARCH_CACHE_TTL = 60  # 秒
+_SEARCH_CACHE_MAXSIZE = 256
+
+# 操作历史只保留最近的若干条，长时间运行时内存占用不随调用次数增长
+_OPERATION_HISTORY_MAXLEN = 256
+
+
 @dataclass
 class MemoryOperation:
     """记忆操作结果"""
@@ -30,6 +149,40 @@ class MemoryOperation:
     data: Any = None
 
 
+# 已确认开启 int8 标量量化的集合（每个进程只检查一次，切换用户重建 Memory 时不再访问 Qdrant）
+_quantized_collections = set()
+
+
+def _build_memory(config: Dict) -> Memory:
+    """按配置创建 Memory；向量库为 Qdrant 且 QDRANT_QUANTIZATION 未关闭时开启 int8 标量量化：
+    量化向量常驻内存、原始向量落盘，检索时以原始向量重打分（与 MemoryManager._ensure_quantization 相同）"""
+    memory = Memory.from_config(config)
+    vector_store = getattr(memory, "vector_store", None)
+    client = getattr(vector_store, "client", None)
+    if (client is None or type(vector_store).__module__ != "mem0.vector_stores.qdrant"
+            or os.getenv("QDRANT_QUANTIZATION", "true").lower() != "true"):
+        return memory
+    collection_name = vector_store.collection_name
+    if collection_name in _quantized_collections:
+        return memory
+    try:
+        from qdrant_client import models
+        info = client.get_collection(collection_name)
+        if info.config.quantization_config is None:
+            client.update_collection(
+                collection_name=collection_name,
+                vectors_config={"": models.VectorParamsDiff(on_disk=True)},
+                quantization_config=models.ScalarQuantization(
+                    scalar=models.ScalarQuantizationConfig(type=models.ScalarType.INT8, quantile=0.99, always_ram=True)
+                ),
+            )
+            logger.info(f"集合 {collection_name} 已开启 int8 标量量化")
+        _quantized_collections.add(collection_name)
+    except Exception as e:
+        logger.warning(f"开启标量量化失败 ({collection_name}): {e}")
+    return memory
+
+
 class MemoryToolManager:
     """
     记忆工具管理器 - 管理所有记忆相关的工具函数
@@ -44,8 +197,13 @@ class MemoryToolManager:
             llm_config: LLM配置，如果为None则使用MEM0_CONFIG中的配置
         """
         self.llm_config = llm_config or MEM0_CONFIG
-        self.memory = Memory.from_config(self.llm_config)
-        self._operation_history: List[MemoryOperation] = []
+        self.memory = _build_memory(self.llm_config)
+        self._operation_history: "deque[MemoryOperation]" = deque(maxlen=_OPERATION_HISTORY_MAXLEN)
+
+        # (用户记忆版本, user_id, 空白规范化后的查询, limit) -> (过期时间, 结果)；写入后递增用户版本号即令旧条目失效
+        self._search_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._search_versions: Dict[str, int] = {}
+        self._search_cache_lock = threading.Lock()
 
         # 定义所有可用的工具
         self.tools = self._define_tools()
@@ -57,82 +215,12 @@ class MemoryToolManager:
         Returns:
             工具定义列表（符合OpenAI Function Calling格式）
         """
-        return [
-            {
-                "type": "function",
-                "function": {
-                    "name": "add_memory",
-                    "description": "向记忆系统添加新的记忆。当用户提供关于自己的信息时，应该调用此工具来存储这些信息。",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "content": {
-                                "type": "string",
-                                "description": "要存储的记忆内容。应该是关于用户的事实信息，例如：'用户叫张三，来自北京，是一名工程师'"
-                            }
-                        },
-                        "required": ["content"]
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "search_memories",
-                    "description": "在记忆系统中搜索相关记忆。当需要查找关于用户的信息时调用此工具。",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "query": {
-                                "type": "string",
-                                "description": "搜索查询，例如：'用户的工作是什么？' 或 '用户的兴趣爱好'"
-                            },
-                            "limit": {
-                                "type": "integer",
-                                "description": "返回结果的最大数量，默认为5",
-                                "default": 5
-                            }
-                        },
-                        "required": ["query"]
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "delete_memory",
-                    "description": "从记忆系统中删除特定的记忆。需要先通过search_memories或get_all_memories获取记忆ID，然后才能删除。",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "memory_id": {
-                                "type": "string",
-                                "description": "要删除的记忆的UUID（唯一标识符），通常是一个UUID字符串，例如：'0ec3af98-1b41-47c6-9704-9163f333153e'。必须从search_memories或get_all_memories的结果中获取。"
-                            }
-                        },
-                        "required": ["memory_id"]
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "get_all_memories",
-                    "description": "获取存储的所有记忆。用于查看完整的记忆列表。",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "limit": {
-                                "type": "integer",
-                                "description": "返回的最大记忆数量，默认为20",
-                                "default": 20
-                            }
-                        },
-                        "required": []
-                    }
-                }
-            },
-        ]
+        return _TOOLS
+
+    def _invalidate_search(self, user_id: str):
+        """记忆写入完成后调用：递增该用户的版本号，旧的检索缓存不再命中"""
+        with self._search_cache_lock:
+            self._search_versions[user_id] = self._search_versions.get(user_id, 0) + 1
 
     def add_memory(self, content: str, user_id: str = "default_user") -> MemoryOperation:
         """
@@ -147,10 +235,13 @@ class MemoryToolManager:
         """
         try:
             logger.info(f"添加记忆: {content[:50]}...")
-            result = self.memory.add(
-                messages=[{"role": "user", "content": content}],
-                user_id=user_id
-            )
+            try:
+                result = self.memory.add(
+                    messages=[{"role": "user", "content": content}],
+                    user_id=user_id
+                )
+            finally:
+                self._invalidate_search(user_id)
             
             operation = MemoryOperation(
                 success=True,
@@ -185,14 +276,30 @@ class MemoryToolManager:
         """
         try:
             logger.info(f"搜索记忆: {query}")
-            result = self.memory.search(
-                query=query,
-                user_id=user_id,
-                limit=limit
-            )
-            
-            # 处理结果格式
-            memories = result.get("results", []) if isinstance(result, dict) else result
+            now = time.monotonic()
+            with self._search_cache_lock:
+                key = (self._search_versions.get(user_id, 0), user_id, " ".join(query.split()), limit)
+                cached = self._search_cache.get(key)
+                if cached is not None and cached[0] > now:
+                    self._search_cache.move_to_end(key)
+                    memories = cached[1]
+                else:
+                    memories = None
+
+            if memories is None:
+                result = self.memory.search(
+                    query=query,
+                    user_id=user_id,
+                    limit=limit
+                )
+
+                # 处理结果格式
+                memories = result.get("results", []) if isinstance(result, dict) else result
+                with self._search_cache_lock:
+                    self._search_cache[key] = (now + _SEARCH_CACHE_TTL, memories)
+                    self._search_cache.move_to_end(key)
+                    while len(self._search_cache) > _SEARCH_CACHE_MAXSIZE:
+                        self._search_cache.popitem(last=False)
             
             operation = MemoryOperation(
                 success=True,
@@ -225,7 +332,10 @@ class MemoryToolManager:
         try:
             logger.info(f"删除记忆: {memory_id}")
             # mem0的delete方法只接受memory_id
-            result = self.memory.delete(memory_id=memory_id)
+            try:
+                result = self.memory.delete(memory_id=memory_id)
+            finally:
+                self._invalidate_search(user_id)
             
             operation = MemoryOperation(
                 success=True,
@@ -283,7 +393,7 @@ class MemoryToolManager:
         self, old_content: str, new_content: str, user_id: str = "default_user"
     ) -> MemoryOperation:
         """
-        更新记忆（通过删除旧的和添加新的）
+        更新记忆（找到旧记忆后原地更新；mem0 不支持 update 时退回删除旧的并添加新的）
 
         Args:
             old_content: 原始内容
@@ -314,16 +424,29 @@ class MemoryToolManager:
                 self._operation_history.append(operation)
                 return operation
             
-            # 删除旧记忆并添加新记忆
             memory_id = memories[0].get("id")
+            data = None
+            updated = False
             if memory_id:
-                self.delete_memory(memory_id, user_id)
-            
-            result = self.add_memory(new_content, user_id)
+                # 原地更新：一次调用、只对新内容向量化
+                try:
+                    try:
+                        data = self.memory.update(memory_id=memory_id, data=new_content)
+                        updated = True
+                    finally:
+                        self._invalidate_search(user_id)
+                except (AttributeError, NotImplementedError):
+                    pass
+
+            if not updated:
+                # 删除旧记忆并添加新记忆
+                if memory_id:
+                    self.delete_memory(memory_id, user_id)
+                data = self.add_memory(new_content, user_id).data
             
             operation = MemoryOperation(
                 success=True,
-                data=result.data,
+                data=data,
                 message="记忆更新成功"
             )
             self._operation_history.append(operation)
@@ -429,6 +552,8 @@ class ConversationalMemoryAgent:
         
         # 初始化记忆工具管理器
         self.tool_manager = MemoryToolManager()
+        # 工具调用线程池：同一轮的多个工具（均为 mem0 网络调用）并发执行
+        self._tool_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="memory-tool")
         
         # 对话历史
         self.conversation_history: List[Dict] = []
@@ -436,30 +561,13 @@ class ConversationalMemoryAgent:
 
     def _build_system_prompt(self) -> str:
         """构建系统提示"""
-        return """你是一个有帮助的AI助手，具有记忆管理能力。
+        return _SYSTEM_PROMPT
 
-你可以使用以下工具来管理用户的记忆：
-1. add_memory - 添加新的记忆
-2. search_memories - 搜索相关记忆
-3. delete_memory - 删除记忆（需要使用从search_memories或get_all_memories返回的ID）
-4. get_all_memories - 获取所有记忆
-5. update_memory - 更新记忆
-
-**关键指导原则：**
-- 当用户提供关于自己的信息（如姓名、职业、兴趣、经历等）时，主动使用 add_memory 工具来存储这些信息
-- 当用户询问关于他们自己的问题时，先使用 search_memories 工具来查找相关记忆
-- 不要对用户说"我没有你的信息"，而是使用 search_memories 工具来查找
-- **删除记忆时的正确流程**：
-  1. 先调用 search_memories 或 get_all_memories 查找要删除的记忆
-  2. 从返回结果中获取记忆的ID（格式为 UUID）
-  3. 使用 delete_memory 工具并传入正确的 memory_id（不是记忆内容，而是ID！）
-- 保持对话自然流畅，在必要时才明确提及使用了记忆工具
-- 大多数情况下，用户更新信息时，直接使用 add_memory 会自动处理更新，无需显式删除
-- 定期总结用户的信息以保持准确性
-
-**重要提示：delete_memory 的 memory_id 参数必须是从搜索结果中获取的 UUID，不能是记忆的文本内容！**
-
-记住：用户希望通过对话来管理记忆，而不是手动操作。因此要主动、智能地使用这些工具。"""
+    def _run_tool(self, tool_name: str, raw_arguments: str) -> str:
+        """在线程池中解析参数并执行单个工具调用"""
+        tool_input = json.loads(raw_arguments)
+        logger.info(f"调用工具: {tool_name}, 参数: {tool_input}")
+        return self.tool_manager.process_tool_call(tool_name, tool_input, self.user_id)
 
     def chat(self, user_message: str) -> str:
         """
@@ -471,6 +579,19 @@ class ConversationalMemoryAgent:
         Returns:
             助手回复
         """
+        return "".join(self.chat_stream(user_message))
+
+    def chat_stream(self, user_message: str) -> Iterator[str]:
+        """
+        流式对话：以流式调用LLM，工具调用参数一到齐即提交执行；
+        每轮文本先缓存，确认本轮没有工具调用后才作为最终回复产出（调用工具的中间轮次文本不输出，与 chat() 的返回一致）
+
+        Args:
+            user_message: 用户消息
+
+        Yields:
+            助手回复的文本片段
+        """
         # 添加用户消息到历史
         self.conversation_history.append({
             "role": "user",
@@ -480,85 +601,100 @@ class ConversationalMemoryAgent:
         max_iterations = 5
         iteration = 0
 
+        # 构建消息列表（包括系统提示）只做一次，循环内新增的消息同时追加到历史与本列表
+        messages = [_SYSTEM_MESSAGE, *self.conversation_history]
+
+        def remember(message: Dict):
+            self.conversation_history.append(message)
+            messages.append(message)
+
         while iteration < max_iterations:
             iteration += 1
             logger.info(f"对话迭代 {iteration}/{max_iterations}")
 
-            # 构建消息列表（包括系统提示，直接添加到消息中）
-            messages = [
-                {"role": "system", "content": self._build_system_prompt()}
-            ] + self.conversation_history
-
+            content_parts = []
             try:
-                # 调用LLM
-                response = self.client.chat.completions.create(
+                # 调用LLM（流式；事先无法知道本轮是否为最终回复，文本先缓存到本轮结束）
+                stream = self.client.chat.completions.create(
                     model=self.model,
                     messages=messages,
                     tools=self.tool_manager.tools,
                     tool_choice="auto",
                     temperature=0.7,
-                    max_tokens=1500
+                    max_tokens=1500,
+                    stream=True
                 )
 
-                # 检查响应
-                choice = response.choices[0]
-                
+                # 工具调用以增量片段到达，按 index 拼接；
+                # 出现更大 index 的片段时，之前的调用参数已完整，立即提交执行，与后续生成重叠
+                pending_calls: Dict[int, Dict] = {}
+                futures: Dict[int, Future] = {}
+
+                def dispatch_before(index: Optional[int] = None):
+                    for i, call in pending_calls.items():
+                        if i not in futures and (index is None or i < index):
+                            futures[i] = self._tool_pool.submit(self._run_tool, call["name"], call["arguments"])
+
+                for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta
+                    if delta.content:
+                        content_parts.append(delta.content)
+                    for tc in delta.tool_calls or []:
+                        dispatch_before(tc.index)
+                        call = pending_calls.setdefault(tc.index, {"id": None, "name": "", "arguments": ""})
+                        if tc.id:
+                            call["id"] = tc.id
+                        if tc.function:
+                            if tc.function.name:
+                                call["name"] += tc.function.name
+                            if tc.function.arguments:
+                                call["arguments"] += tc.function.arguments
+
                 # 如果LLM要求调用工具
-                if choice.finish_reason == "tool_calls" and choice.message.tool_calls:
-                    tool_calls = choice.message.tool_calls
-                    
+                if pending_calls:
+                    dispatch_before()
+                    order = sorted(pending_calls)
+                    tool_calls = [pending_calls[i] for i in order]
+
                     # 添加LLM的回复到历史（包含工具调用）
-                    assistant_message = {
+                    remember({
                         "role": "assistant",
-                        "content": choice.message.content or ""
-                    }
-                    
-                    # 正确的方式：将tool_calls添加到assistant消息
-                    if tool_calls:
-                        assistant_message["tool_calls"] = [
+                        "content": "".join(content_parts),
+                        "tool_calls": [
                             {
-                                "id": tc.id,
+                                "id": tc["id"],
                                 "type": "function",
                                 "function": {
-                                    "name": tc.function.name,
-                                    "arguments": tc.function.arguments
+                                    "name": tc["name"],
+                                    "arguments": tc["arguments"]
                                 }
                             }
                             for tc in tool_calls
                         ]
-                    
-                    self.conversation_history.append(assistant_message)
-                    
-                    # 处理工具调用并收集结果
-                    for tool_call in tool_calls:
-                        tool_name = tool_call.function.name
-                        tool_input = json.loads(tool_call.function.arguments)
-
-                        logger.info(f"调用工具: {tool_name}, 参数: {tool_input}")
-
-                        # 执行工具
-                        tool_result = self.tool_manager.process_tool_call(
-                            tool_name, tool_input, self.user_id
-                        )
-                        
+                    })
+
+                    # 按调用顺序收集结果（tool_call_id 须与 assistant 消息中的顺序对应）
+                    for i in order:
                         # 添加工具结果到历史
-                        self.conversation_history.append({
+                        remember({
                             "role": "tool",
-                            "tool_call_id": tool_call.id,
-                            "content": tool_result
+                            "tool_call_id": pending_calls[i]["id"],
+                            "content": futures[i].result()
                         })
-                    
+
                     # 继续循环，让LLM基于工具结果生成最终回复
                     continue
 
-                else:
-                    # LLM返回最终消息
-                    final_message = choice.message.content
-                    self.conversation_history.append({
-                        "role": "assistant",
-                        "content": final_message
-                    })
-                    return final_message
+                # LLM返回最终消息：本轮没有工具调用，缓存的文本即最终回复
+                final_content = "".join(content_parts)
+                self.conversation_history.append({
+                    "role": "assistant",
+                    "content": final_content
+                })
+                yield final_content
+                return
 
             except Exception as e:
                 logger.error(f"对话处理失败: {str(e)}", exc_info=True)
@@ -567,7 +703,8 @@ class ConversationalMemoryAgent:
                     "role": "assistant",
                     "content": error_message
                 })
-                return error_message
+                yield error_message
+                return
 
         # 超过最大迭代次数
         error_message = "对话过程中达到最大迭代次数"
@@ -575,7 +712,7 @@ class ConversationalMemoryAgent:
             "role": "assistant",
             "content": error_message
         })
-        return error_message
+        yield error_message
 
     def get_conversation_history(self) -> List[Dict]:
         """获取对话历史"""
@@ -589,5 +726,5 @@ class ConversationalMemoryAgent:
     def set_user_id(self, user_id: str):
         """设置用户ID"""
         self.user_id = user_id
-        self.tool_manager.memory = Memory.from_config(MEM0_CONFIG)
+        self.tool_manager.memory = _build_memory(MEM0_CONFIG)
         logger.info(f"用户ID已设置为: {user_id}")
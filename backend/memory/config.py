@@ -1,10 +1,25 @@
 # backend/memory/config.py
 
 import os
+from functools import lru_cache
 from dotenv import load_dotenv
+from qdrant_client import QdrantClient
 
 load_dotenv()
 
+@lru_cache(maxsize=1)
+def get_qdrant_client() -> QdrantClient:
+    """进程内共享的 Qdrant 客户端：各 Mem0 实例（按 LLM 配置区分）复用同一连接，
+    gRPC 通道基于 HTTP/2 多路复用，免去每次调用的连接建立"""
+    return QdrantClient(
+        host=os.getenv("QDRANT_HOST", "localhost"),
+        port=int(os.getenv("QDRANT_PORT", 6333)),
+        grpc_port=int(os.getenv("QDRANT_GRPC_PORT", 6334)),
+        prefer_grpc=os.getenv("QDRANT_PREFER_GRPC", "true").lower() == "true",
+        grpc_options={"grpc.keepalive_time_ms": 30000},
+        timeout=10,
+    )
+
 def get_mem0_config(llm_settings=None):
     if llm_settings is None:
         llm_settings = {}
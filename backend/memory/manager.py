@@ -3,17 +3,97 @@
 import json
 import hashlib
 import time
+import threading
 import os  # [必须导入]
+from collections import OrderedDict
 from mem0 import Memory
-from .config import get_mem0_config
-from typing import List, Dict, Any, Optional
+from .config import get_mem0_config, get_qdrant_client
+from typing import List, Dict, Any, Optional, Tuple, Callable
+from concurrent.futures import ThreadPoolExecutor
 import logging
 
 logger = logging.getLogger(__name__)
 
+# 检索结果缓存：交互中同一问题会被反复检索，命中时免去查询向量化与 Qdrant/图谱往返
+_SEARCH_CACHE_TTL = 60  # 秒
+_SEARCH_CACHE_MAXSIZE = 1024
+
+# 向量化结果缓存：图谱实体名、重复的查询与事实在各客户端间只向量化一次
+_EMBED_CACHE_MAXSIZE = 4096
+
+class _CachedEmbedder:
+    """包装 Mem0 的 embedding_model，按 (模型, 用途, 文本摘要) 缓存向量，其余属性透传"""
+    _cache: 'OrderedDict[tuple, Any]' = OrderedDict()
+    _lock = threading.Lock()
+
+    def __init__(self, inner):
+        self._inner = inner
+
+    def __getattr__(self, name):
+        return getattr(self._inner, name)
+
+    def _key(self, text, memory_action) -> tuple:
+        model = getattr(getattr(self._inner, 'config', None), 'model', None)
+        return (model, memory_action, hashlib.blake2b(str(text).encode(), digest_size=16).digest())
+
+    def embed(self, text, memory_action=None):
+        key = self._key(text, memory_action)
+        with self._lock:
+            vector = self._cache.get(key)
+            if vector is not None:
+                self._cache.move_to_end(key)
+                return vector
+        vector = self._inner.embed(text, memory_action)
+        with self._lock:
+            self._cache[key] = vector
+            if len(self._cache) > _EMBED_CACHE_MAXSIZE:
+                self._cache.popitem(last=False)
+        return vector
+
+    def embed_many(self, texts: List[str], memory_action=None):
+        """一次批量请求向量化多条文本并写入缓存，之后的 embed() 直接命中"""
+        with self._lock:
+            pending = {}
+            for text in texts:
+                key = self._key(text, memory_action)
+                if key not in self._cache: pending[key] = text
+        if not pending: return
+        vectors = self._batch_embed(list(pending.values()), memory_action)
+        with self._lock:
+            for key, vector in zip(pending, vectors):
+                self._cache[key] = vector
+            while len(self._cache) > _EMBED_CACHE_MAXSIZE:
+                self._cache.popitem(last=False)
+
+    def _batch_embed(self, texts: List[str], memory_action):
+        # 与 Mem0 各 embedder 的单条实现保持同样的预处理与参数，只把输入换成列表
+        inner = self._inner
+        client = getattr(inner, 'client', None)
+        cleaned = [text.replace("\n", " ") for text in texts]
+        if client is not None and hasattr(client, 'embeddings'):  # OpenAI 兼容
+            response = client.embeddings.create(input=cleaned, model=inner.config.model, dimensions=inner.config.embedding_dims)
+            return [item.embedding for item in response.data]
+        if client is not None and hasattr(getattr(client, 'models', None), 'embed_content'):  # Gemini
+            from google.genai import types
+            response = client.models.embed_content(
+                model=inner.config.model, contents=cleaned,
+                config=types.EmbedContentConfig(output_dimensionality=inner.config.embedding_dims)
+            )
+            return [item.values for item in response.embeddings]
+        return [inner.embed(text, memory_action) for text in texts]
+
 class MemoryManager:
     _instance = None
     _clients = {}
+    # key -> (expires_at, result)；key 中带有全局代数与用户的记忆版本号，写入时递增其一即令旧条目失效
+    _search_cache: 'OrderedDict[tuple, Tuple[float, Any]]' = OrderedDict()
+    _search_versions: Dict[str, int] = {}
+    _search_generation = 0
+    # 记忆写入后的回调（参数为 user_id，无法确定用户时为 None），供上层的列表等缓存同步失效
+    _invalidation_listeners: List[Callable[[Optional[str]], None]] = []
+    _search_cache_lock = threading.Lock()
+    # 已确认开启 int8 标量量化的集合（每个进程只检查一次）
+    _quantized_collections = set()
 
     def __new__(cls):
         if cls._instance is None:
@@ -56,6 +136,11 @@ class MemoryManager:
         # =========================================================
 
         config = get_mem0_config(llm_settings)
+        # 所有 Mem0 实例共享同一个 Qdrant 客户端（连接 / gRPC 通道复用）
+        vector_store = config.get('vector_store', {})
+        is_qdrant = vector_store.get('provider') == 'qdrant'
+        if is_qdrant:
+            vector_store['config'].setdefault('client', get_qdrant_client())
         
         # 记录配置状态
         if 'reranker' in config:
@@ -64,9 +149,36 @@ class MemoryManager:
             logger.info(f"ℹ️ Reranker: Disabled")
         
         client = Memory.from_config(config)
+        # 向量库与图谱各持有一个 embedding_model，统一接入共享的向量化缓存
+        client.embedding_model = _CachedEmbedder(client.embedding_model)
+        graph = getattr(client, 'graph', None)
+        if graph is not None and hasattr(graph, 'embedding_model'):
+            graph.embedding_model = _CachedEmbedder(graph.embedding_model)
+        if is_qdrant:
+            self._ensure_quantization(vector_store['config']['client'], vector_store['config'].get('collection_name', 'mem0'))
         self._clients[config_hash] = client
         return client
 
+    def _ensure_quantization(self, qdrant_client, collection_name: str):
+        """集合由 Mem0 创建；首次使用时为其开启 int8 标量量化（量化向量常驻内存、原始向量落盘，检索时以原始向量重打分）"""
+        if collection_name in self._quantized_collections or os.getenv("QDRANT_QUANTIZATION", "true").lower() != "true":
+            return
+        try:
+            from qdrant_client import models
+            info = qdrant_client.get_collection(collection_name)
+            if info.config.quantization_config is None:
+                qdrant_client.update_collection(
+                    collection_name=collection_name,
+                    vectors_config={"": models.VectorParamsDiff(on_disk=True)},
+                    quantization_config=models.ScalarQuantization(
+                        scalar=models.ScalarQuantizationConfig(type=models.ScalarType.INT8, quantile=0.99, always_ram=True)
+                    ),
+                )
+                logger.info(f"✅ 集合 {collection_name} 已开启 int8 标量量化")
+            self._quantized_collections.add(collection_name)
+        except Exception as e:
+            logger.warning(f"⚠️ 开启标量量化失败 ({collection_name}): {e}")
+
     def warm_up_client(self, llm_settings: Dict):
         try:
             self._get_client(llm_settings)
@@ -83,8 +195,7 @@ class MemoryManager:
         return user_id, None
 
     # --- 核心操作 (保持不变，确保引用了最新的 _get_client) ---
-    def add_memory(self, content: str, user_id: str, run_id: Optional[str] = None, scope: str = 'global', metadata: Optional[Dict] = None, llm_settings: Optional[Dict] = None) -> Dict:
-        client = self._get_client(llm_settings)
+    def _build_add_params(self, user_id: str, run_id: Optional[str], scope: str, metadata: Optional[Dict]) -> Dict:
         target_user_id, target_run_id = self._resolve_ids(user_id, run_id, scope)
         params = {"user_id": target_user_id}
         if target_run_id: params["run_id"] = target_run_id
@@ -94,7 +205,51 @@ class MemoryManager:
         if run_id: final_metadata["source_conversation_id"] = str(run_id)
         final_metadata["scope"] = scope
         params["metadata"] = final_metadata
+        return params
+
+    # --- 检索缓存 ---
+    def _invalidate_search(self, user_id: Optional[str] = None):
+        """记忆写入完成后令检索缓存失效：已知用户时只递增其版本号，否则递增全局代数使全部条目失效
+        （须在写入之后调用，否则写入期间的检索会以新版本号缓存旧结果；
+        不能直接清空缓存，进行中的检索仍会以旧键写回写入前的结果）"""
+        with self._search_cache_lock:
+            if user_id is None:
+                type(self)._search_generation += 1
+            else:
+                self._search_versions[user_id] = self._search_versions.get(user_id, 0) + 1
+        for listener in self._invalidation_listeners:
+            try:
+                listener(user_id)
+            except Exception as e:
+                logger.warning(f"⚠️ 缓存失效回调失败: {e}")
 
+    @classmethod
+    def add_invalidation_listener(cls, listener: Callable[[Optional[str]], None]):
+        """注册记忆写入后的回调"""
+        cls._invalidation_listeners.append(listener)
+
+    def add_memory(self, content: str, user_id: str, run_id: Optional[str] = None, scope: str = 'global', metadata: Optional[Dict] = None, llm_settings: Optional[Dict] = None) -> Dict:
+        client = self._get_client(llm_settings)
+        params = self._build_add_params(user_id, run_id, scope, metadata)
+        try:
+            return self._add_with_retry(client, content, params, llm_settings)
+        finally:
+            self._invalidate_search(user_id)
+
+    def add_memory_multi(self, content: str, user_id: str, targets: List[Tuple[str, Optional[str]]], metadata: Optional[Dict] = None, llm_settings: Optional[Dict] = None) -> List[Dict]:
+        """同一条内容写入多个 (scope, run_id) 目标：只解析一次客户端，各目标并发写入"""
+        client = self._get_client(llm_settings)
+        params_list = [self._build_add_params(user_id, run_id, scope, dict(metadata or {})) for scope, run_id in targets]
+        try:
+            if len(params_list) == 1:
+                return [self._add_with_retry(client, content, params_list[0], llm_settings)]
+            with ThreadPoolExecutor(max_workers=len(params_list)) as executor:
+                futures = [executor.submit(self._add_with_retry, client, content, params, llm_settings) for params in params_list]
+                return [future.result() for future in futures]
+        finally:
+            self._invalidate_search(user_id)
+
+    def _add_with_retry(self, client, content: str, params: Dict, llm_settings: Optional[Dict]) -> Dict:
         messages = [{"role": "user", "content": content}]
         try:
             return client.add(messages, **params)
@@ -102,23 +257,48 @@ class MemoryManager:
             if "404" in str(e) or "Not found" in str(e):
                 logger.warning(f"⚠️ 集合丢失重试: {e}")
                 config_hash = self._get_config_hash(llm_settings)
-                if config_hash in self._clients: del self._clients[config_hash]
+                self._clients.pop(config_hash, None)
                 client = self._get_client(llm_settings)
                 return client.add(messages, **params)
             raise e
 
+    def prefetch_search_embeddings(self, queries: List[str], llm_settings: Optional[Dict] = None):
+        """同一轮的多个检索查询合并为一次向量化请求（尽力而为，失败时各检索照常单独向量化）"""
+        try:
+            embedder = self._get_client(llm_settings).embedding_model
+            if isinstance(embedder, _CachedEmbedder):
+                embedder.embed_many(queries, "search")
+        except Exception as e:
+            logger.warning(f"⚠️ 批量向量化失败: {e}")
+
     def search_memories(self, query: str, user_id: str, run_id: Optional[str] = None, scope: str = 'global', limit: int = 5, llm_settings: Optional[Dict] = None) -> List[Dict]:
         client = self._get_client(llm_settings)
         target_user_id, target_run_id = self._resolve_ids(user_id, run_id, scope)
         params = {"user_id": target_user_id, "limit": limit}
         if target_run_id: params["run_id"] = target_run_id
+
+        # 版本号在检索前取得：检索期间发生的写入会使本次结果以旧版本入缓存，不会被后续读取命中
+        now = time.monotonic()
+        with self._search_cache_lock:
+            key = (self._search_generation, self._search_versions.get(user_id, 0), self._get_config_hash(llm_settings), target_user_id, target_run_id, query, limit)
+            cached = self._search_cache.get(key)
+            if cached is not None and cached[0] > now:
+                self._search_cache.move_to_end(key)
+                return cached[1]
         
         try:
-            return client.search(query, **params)
+            result = client.search(query, **params)
         except Exception as e:
             logger.error(f"Mem0 Search Error: {e}")
             return []
 
+        with self._search_cache_lock:
+            self._search_cache[key] = (now + _SEARCH_CACHE_TTL, result)
+            self._search_cache.move_to_end(key)
+            while len(self._search_cache) > _SEARCH_CACHE_MAXSIZE:
+                self._search_cache.popitem(last=False)
+        return result
+
     def get_memories(self, user_id: str, run_id: Optional[str] = None, limit: int = 100, llm_settings: Optional[Dict] = None) -> Dict[str, Any]:
         client = self._get_client(llm_settings)
         if run_id and str(run_id) != "0":
@@ -146,16 +326,64 @@ class MemoryManager:
         return {"results": results, "relations": relations}
 
     # ... update/delete ...
+    # 仅凭 memory_id 无法得知所属用户，令整个检索缓存失效
     def update_memory(self, memory_id: str, new_data: str, llm_settings: Optional[Dict] = None) -> Dict:
-        return self._get_client(llm_settings).update(memory_id, new_data)
+        try:
+            return self._get_client(llm_settings).update(memory_id, new_data)
+        finally:
+            self._invalidate_search()
 
     def delete_memory(self, memory_id: str, llm_settings: Optional[Dict] = None) -> Dict:
-        return self._get_client(llm_settings).delete(memory_id)
+        try:
+            return self._get_client(llm_settings).delete(memory_id)
+        finally:
+            self._invalidate_search()
 
     def delete_all_memories(self, user_id: str, run_id: Optional[str] = None, llm_settings: Optional[Dict] = None) -> Dict:
         client = self._get_client(llm_settings)
-        if run_id:
-            target_user_id = f"{user_id}_conv_{run_id}"
-            return client.delete_all(user_id=target_user_id)
-        else:
-            return client.delete_all(user_id=user_id)
\ No newline at end of file
+        try:
+            if run_id:
+                target_user_id = f"{user_id}_conv_{run_id}"
+                return client.delete_all(user_id=target_user_id)
+            else:
+                return client.delete_all(user_id=user_id)
+        finally:
+            self._invalidate_search(user_id)
+
+    def delete_conversations_memories(self, user_id: str, run_ids: List[str], llm_settings: Optional[Dict] = None) -> Dict:
+        """批量删除多个对话的局部记忆：Qdrant 与 Neo4j 图谱各按 user_id 列表过滤删除一次
+        （不经 Memory.delete_all，它会逐条删除并重建整个集合；批量删除不写入 Mem0 的历史记录）"""
+        client = self._get_client(llm_settings)
+        target_user_ids = [f"{user_id}_conv_{run_id}" for run_id in run_ids]
+        try:
+            if not self._batch_delete_by_user_ids(client, target_user_ids):
+                # 非 Qdrant 向量库：退回逐个对话删除
+                for target_user_id in target_user_ids:
+                    client.delete_all(user_id=target_user_id)
+        finally:
+            self._invalidate_search(user_id)
+        return {"deleted_run_ids": list(run_ids)}
+
+    def _batch_delete_by_user_ids(self, client, target_user_ids: List[str]) -> bool:
+        """向量库为 Qdrant 时以一次过滤删除清除这些 user_id 的全部记忆，返回是否已处理"""
+        vector_store = client.vector_store
+        if type(vector_store).__module__ != "mem0.vector_stores.qdrant":
+            return False
+        from qdrant_client import models
+        vector_store.client.delete(
+            collection_name=vector_store.collection_name,
+            points_selector=models.FilterSelector(filter=models.Filter(must=[
+                models.FieldCondition(key="user_id", match=models.MatchAny(any=target_user_ids))
+            ])),
+        )
+        if client.enable_graph:
+            graph = client.graph
+            if type(graph).__module__ == "mem0.memory.graph_memory":
+                graph.graph.query(
+                    f"MATCH (n {graph.node_label}) WHERE n.user_id IN $user_ids DETACH DELETE n",
+                    params={"user_ids": target_user_ids},
+                )
+            else:
+                for target_user_id in target_user_ids:
+                    graph.delete_all({"user_id": target_user_id})
+        return True
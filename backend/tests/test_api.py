@@ -18,6 +18,30 @@ def print_response(response):
         print(f"Raw Response: {response.text}")
         return None
 
+def check(condition, description):
+    print(f"{'✅' if condition else '❌'} {description}")
+    return condition
+
+def check_cursor_pagination(url, items_key):
+    """游标分页：首页、next_cursor 往返（两页不重叠）、非法 cursor 返回 400"""
+    resp = SESSION.get(url, params={"cursor": "", "limit": 1})
+    data = print_response(resp)
+    if not check(resp.status_code == 200 and len(data['data'][items_key]) == 1, "游标分页首页返回 1 条"):
+        return False
+    pagination = data['data']['pagination']
+    if not check(pagination['has_next'] and pagination['next_cursor'], "首页返回 has_next 与 next_cursor"):
+        return False
+    first_id = data['data'][items_key][0]['id']
+
+    resp = SESSION.get(url, params={"cursor": pagination['next_cursor'], "limit": 1})
+    data = print_response(resp)
+    if not check(resp.status_code == 200 and data['data'][items_key] and data['data'][items_key][0]['id'] != first_id, "按 next_cursor 取到不重叠的下一页"):
+        return False
+
+    resp = SESSION.get(url, params={"cursor": "invalid-cursor"})
+    print_response(resp)
+    return check(resp.status_code == 400, "非法 cursor 返回 400")
+
 def run_test():
     # 1. 注册用户
     print_step("1. 注册用户")
@@ -59,12 +83,43 @@ def run_test():
     resp = SESSION.get(f"{BASE_URL}/api/auth/me")
     print_response(resp)
 
+    # 3.1 修改密码：旧 Token 立即失效，返回的新 Token 可用
+    print_step("3.1 修改密码")
+    new_password = "new_password456"
+    resp = SESSION.put(f"{BASE_URL}/api/auth/password", json={"old_password": password, "new_password": new_password})
+    data = print_response(resp)
+    if not check(resp.status_code == 200, "修改密码成功"):
+        print("修改密码失败，测试停止")
+        return
+    new_token = data['data']['access_token']
+
+    resp = requests.get(f"{BASE_URL}/api/auth/me", headers={'Authorization': f'Bearer {token}'})
+    print_response(resp)
+    if not check(resp.status_code == 401, "旧 Token 访问 /api/auth/me 返回 401"):
+        print("旧 Token 未被吊销，测试停止")
+        return
+
+    resp = requests.get(f"{BASE_URL}/api/auth/me", headers={'Authorization': f'Bearer {new_token}'})
+    print_response(resp)
+    if not check(resp.status_code == 200, "新 Token 访问 /api/auth/me 成功"):
+        print("新 Token 不可用，测试停止")
+        return
+    token = new_token
+    SESSION.headers.update({'Authorization': f'Bearer {token}'})
+
     # 4. 创建对话
     print_step("4. 创建新对话")
     resp = SESSION.post(f"{BASE_URL}/api/conversations", json={"title": "终端测试对话"})
     data = print_response(resp)
     conversation_id = data['data']['id']
 
+    # 4.1 对话列表游标分页 (再建一个对话，保证至少两页)
+    print_step("4.1 对话列表游标分页")
+    SESSION.post(f"{BASE_URL}/api/conversations", json={"title": "分页测试对话"})
+    if not check_cursor_pagination(f"{BASE_URL}/api/conversations", 'conversations'):
+        print("对话列表游标分页失败，测试停止")
+        return
+
     # 5. 发送消息 (注意：如果没有配置模型API Key，这里会提示配置)
     print_step("5. 发送消息")
     msg_payload = {
@@ -77,6 +132,12 @@ def run_test():
     if data and 'assistant_message' in data.get('data', {}):
         assistant_msg = data['data']['assistant_message']['content']
         print(f"\n[AI 回复]: {assistant_msg}")
+
+    # 6. 消息列表游标分页 (上一步已写入用户消息与助手回复)
+    print_step("6. 消息列表游标分页")
+    if not check_cursor_pagination(f"{BASE_URL}/api/conversations/{conversation_id}/messages", 'messages'):
+        print("消息列表游标分页失败，测试停止")
+        return
     
     print_step("测试完成")
 
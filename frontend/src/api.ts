@@ -164,10 +164,17 @@ export const authAPI = {
   },
 
   updatePassword: async (oldPassword: string, newPassword: string) => {
-    return request('/auth/password', {
+    const data = await request<{
+      access_token: string;
+      token_type: string;
+      expires_in: number;
+    }>('/auth/password', {
       method: 'PUT',
       body: JSON.stringify({ old_password: oldPassword, new_password: newPassword }),
     });
+    // 修改密码会吊销旧 token，改用后端签发的新 token
+    setAuthToken(data.access_token);
+    return data;
   },
 
   refreshToken: async () => {